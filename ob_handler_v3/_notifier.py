@@ -0,0 +1,87 @@
+"""
+Notification Utility
+
+Description:
+This file lets the downloader wake up the processor as soon as a L2 file has been downloaded,
+so that a target gets processed right after its last L2 file arrives instead of at the next polling interval.
+Every processor listens on its own local datagram socket in params.notification_socket_dir, named after its host and PID,
+and the downloader sends a message to all the sockets of its host. Sockets left behind by processors that are gone are removed.
+If no processor is listening, notifications are simply dropped - the processor's polling loop stays as a fallback.
+"""
+
+# local imports
+import params
+
+import os
+import select
+import socket
+
+
+# the sockets of this host's processors are named <host>:<pid>.sock - the data folder may be shared by several hosts
+HOST_PREFIX = socket.gethostname() + ':'
+
+# the socket this process listens on
+def ListenerPath():
+    return params.notification_socket_dir + HOST_PREFIX + str(os.getpid()) + ".sock"
+
+
+# open the socket the processor listens on, replacing one left behind by a previous process with the same PID
+def OpenListener():
+    os.makedirs(params.notification_socket_dir, exist_ok=True)
+    try:
+        os.remove(ListenerPath())
+    except FileNotFoundError:
+        pass
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    listener.bind(ListenerPath())
+    return listener
+
+
+# close the listener and remove its socket
+def CloseListener(listener):
+    listener.close()
+    try:
+        os.remove(ListenerPath())
+    except FileNotFoundError:
+        pass
+
+
+# wait up to <timeout> seconds for a notification. returns True if one arrived
+# all notifications that arrived in the meantime are consumed, as one wake-up covers all of them
+def WaitForNotification(listener, timeout):
+    if not select.select([listener], [], [], timeout)[0]:
+        return False
+
+    try:
+        while True:
+            listener.recv(1024, socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        pass
+
+    return True
+
+
+# notify all the processors of this host that the specified L2 file has been downloaded
+def Notify(filename):
+    try:
+        paths = [entry.path for entry in os.scandir(params.notification_socket_dir) if entry.name.startswith(HOST_PREFIX)]
+    except FileNotFoundError: # no processor has run yet
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.setblocking(False)
+        for path in paths:
+            try:
+                sender.sendto(filename.encode(), path)
+
+            # the processor is gone, but its socket was left behind
+            except ConnectionRefusedError:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            # the processor just stopped, or its socket buffer is full (in which case it has been woken up already)
+            except OSError:
+                pass
@@ -14,6 +14,8 @@ import _util as util
 
 import os
 import sqlite3
+import time
+import threading
 from datetime import datetime
 
 # queries
@@ -24,6 +26,9 @@ CREATE TABLE IF NOT EXISTS L3m_files (  id              TEXT PRIMARY KEY,
                                         file_status     INTEGER,
                                         created_at      TEXT,
                                         verifier_bit    INTEGER DEFAULT 0,
+                                        mission         TEXT,
+                                        type            TEXT,
+                                        date            TEXT,
                                         UNIQUE(id)
                                         );
 CREATE TABLE IF NOT EXISTS L2_files (   id              TEXT PRIMARY KEY,
@@ -34,10 +39,88 @@ CREATE TABLE IF NOT EXISTS L2_files (   id              TEXT PRIMARY KEY,
                                         priority        INTEGER,
                                         created_at      TEXT,
                                         verifier_bit    INTEGER DEFAULT 0,
+                                        mission         TEXT,
+                                        type            TEXT,
+                                        date            TEXT,
+                                        checksum        TEXT,
+                                        checksum_algorithm TEXT,
+                                        size            INTEGER,
                                         FOREIGN KEY (target) REFERENCES L3m_files(id),
                                         UNIQUE(id)
                                         );
+CREATE TABLE IF NOT EXISTS disk_usage ( id              INTEGER PRIMARY KEY CHECK (id=0),
+                                        bytes           INTEGER,
+                                        reconciled_at   TEXT
+                                        );
+CREATE TABLE IF NOT EXISTS leases (     target          TEXT PRIMARY KEY,
+                                        worker          TEXT,
+                                        claimed_at      REAL,
+                                        expires_at      REAL,
+                                        FOREIGN KEY (target) REFERENCES L3m_files(id)
+                                        );
+"""
+
+# columns added to databases created before they existed
+parsed_columns = ["mission", "type", "date"] # parsed out of the filename at insert time
+added_columns = {
+    "L2_files": [(column, "TEXT") for column in parsed_columns] + [
+        ("checksum", "TEXT"), ("checksum_algorithm", "TEXT"), ("size", "INTEGER")], # as given by CMR when queued
+    "L3m_files": [(column, "TEXT") for column in parsed_columns]
+    }
+
+# indexes for the hot access paths
+create_indexes = """
+CREATE INDEX IF NOT EXISTS L2_files_download   ON L2_files (file_status, priority, id, download_url);
+CREATE INDEX IF NOT EXISTS L2_files_ready      ON L2_files (target, file_status, priority, id);
+CREATE INDEX IF NOT EXISTS L2_files_status     ON L2_files (file_status, target);
+DROP INDEX IF EXISTS L2_files_processing;
+DROP INDEX IF EXISTS L2_files_target;
+CREATE INDEX IF NOT EXISTS L2_files_date       ON L2_files (mission, type, date);
+CREATE INDEX IF NOT EXISTS L3m_files_status    ON L3m_files (file_status);
+CREATE INDEX IF NOT EXISTS L2_files_day        ON L2_files (date);
+CREATE INDEX IF NOT EXISTS L3m_files_day       ON L3m_files (date);
+DROP INDEX IF EXISTS L3m_files_date;
+CREATE INDEX IF NOT EXISTS L3m_files_coverage  ON L3m_files (mission, type, date, file_status);
+PRAGMA optimize
+"""
+
+# migration queries
+get_columns = """PRAGMA table_info({0})"""
+add_column = """ALTER TABLE {0} ADD COLUMN {1} {2}"""
+select_unparsed = """   SELECT id
+                            FROM {0}
+                            WHERE date IS NULL"""
+set_parsed_columns = """UPDATE {0}
+                            SET mission=:mission, type=:type, date=:date
+                            WHERE id=:id"""
+
+# CMR search results cache, kept in its own database (params.cmr_cache_filename)
+create_cmr_cache = """
+CREATE TABLE IF NOT EXISTS cmr_pages (  shortname       TEXT,
+                                        temporal        TEXT,
+                                        page_size       INTEGER,
+                                        page_num        INTEGER,
+                                        hits            INTEGER,
+                                        granules        TEXT,
+                                        cached_at       REAL,
+                                        PRIMARY KEY (shortname, temporal, page_size, page_num)
+                                        )
 """
+select_cached_pages = """   SELECT page_num, hits, granules, cached_at
+                                FROM cmr_pages
+                                WHERE shortname=? AND temporal=? AND page_size=?
+                                ORDER BY page_num ASC"""
+delete_cached_pages = """   DELETE FROM cmr_pages
+                                WHERE shortname=:shortname AND temporal=:temporal AND page_size=:page_size"""
+insert_cached_page = """INSERT OR REPLACE
+                            INTO cmr_pages (shortname, temporal, page_size, page_num, hits, granules, cached_at)
+                            VALUES (:shortname, :temporal, :page_size, :page_num, :hits, :granules, :cached_at)"""
+touch_cached_pages = """UPDATE cmr_pages
+                            SET cached_at=?
+                            WHERE shortname=? AND temporal=? AND page_size=?"""
+clear_cached_pages = """DELETE FROM cmr_pages"""
+clear_cached_shortname = """ DELETE FROM cmr_pages
+                                WHERE shortname=?"""
 
 # selection queries
 count_files = """   SELECT count()
@@ -54,19 +137,50 @@ count_existing = """SELECT count()
 select_existing = """   SELECT id
                             FROM {0}
                             WHERE file_status>0"""
-select_ready_for_download = """ SELECT id, download_url
+select_ready_for_download = """ SELECT id, download_url, checksum, checksum_algorithm, size, priority
                                     FROM L2_files
                                     WHERE file_status=0
                                     ORDER BY priority ASC
                                     LIMIT {0}"""
-select_ready_for_processing = """ SELECT id, file_status, target
+select_queued = """ SELECT id, download_url, checksum, checksum_algorithm, size, priority
+                        FROM L2_files
+                        WHERE file_status=0
+                            AND id IN ({0})"""
+# claims up to {0} targets whose L2 files are all downloaded (1) and that aren't leased already, taking over expired leases,
+# and returns the claimed targets with their L2 files
+claim_ready_targets = """   DELETE FROM leases WHERE expires_at<=:now;
+                            INSERT INTO leases (target, worker, claimed_at, expires_at)
+                                SELECT target, :worker, :now, :expires_at
                                     FROM L2_files
-                                    ORDER BY priority ASC, target ASC
-                                    """
-select_unverified_existing = """ SELECT id
-                                    FROM {0}
-                                    WHERE verifier_bit=0
-                                        AND file_status>0 """
+                                    WHERE target IN (SELECT target FROM L2_files WHERE file_status=1)
+                                        AND target NOT IN (SELECT target FROM leases)
+                                    GROUP BY target
+                                    HAVING MIN(file_status)=1 AND MAX(file_status)=1
+                                    ORDER BY MIN(priority) ASC, target ASC
+                                    LIMIT {0};
+                            SELECT target, group_concat(id)
+                                FROM L2_files
+                                WHERE target IN (SELECT target FROM leases WHERE worker=:worker AND claimed_at=:now)
+                                GROUP BY target
+                                ORDER BY MIN(priority) ASC, target ASC"""
+renew_leases = """  UPDATE leases
+                        SET expires_at=:expires_at
+                        WHERE worker=:worker"""
+release_lease = """ DELETE FROM leases
+                        WHERE target=:target AND worker=:worker"""
+release_leases = """ DELETE FROM leases
+                        WHERE worker=:worker"""
+# the dates of a mission and type that already exist in L3m format, answered from the L3m_files_coverage index
+select_covered_dates = """ SELECT DISTINCT date
+                                FROM L3m_files
+                                WHERE mission=:mission AND type=:type
+                                    AND date BETWEEN :start AND :end
+                                    AND file_status>0"""
+# verifier queries, loading whole tables at once
+select_L3m_records = """ SELECT id, file_status, location
+                            FROM L3m_files"""
+select_L2_records = """  SELECT id, file_status, location, target
+                            FROM L2_files"""
 # get queries
 get_file_location = """ SELECT location
                             FROM {0}
@@ -77,19 +191,65 @@ get_file_status = """ SELECT file_status
                            WHERE id='{1}' """
 
 # insertion queries
-insert_L2_processed = """   INSERT
-                                INTO L2_files ({0})
-                                VALUES ({1})"""
-insert_L2_unprocessed = """ INSERT OR IGNORE
-                                INTO L3m_files ({2})
-                                VALUES ({3});
-                            INSERT OR IGNORE
-                                INTO L2_files ({0})
-                                VALUES ({1});"""
 insert_L3m = """INSERT or REPLACE
                     INTO L3m_files ({0})
                     VALUES ({1});"""
 
+# parameterized insertion queries, used for batch writes
+queue_L3m = """ INSERT OR IGNORE
+                    INTO L3m_files (id, file_status, mission, type, date)
+                    VALUES (:target, 0, :mission, :type, :date)"""
+# queuing goes through a temporary table of candidates, so that duplicates are filtered with a single join
+create_queue_candidates = """CREATE TEMP TABLE IF NOT EXISTS queue_candidates (    id                  TEXT PRIMARY KEY,
+                                                                                download_url        TEXT,
+                                                                                target              TEXT,
+                                                                                priority            INTEGER,
+                                                                                mission             TEXT,
+                                                                                type                TEXT,
+                                                                                date                TEXT,
+                                                                                checksum            TEXT,
+                                                                                checksum_algorithm  TEXT,
+                                                                                size                INTEGER,
+                                                                                new                 INTEGER DEFAULT 1
+                                                                                )"""
+clear_queue_candidates = """DELETE FROM queue_candidates"""
+insert_queue_candidate = """INSERT OR IGNORE
+                                INTO queue_candidates (id, download_url, target, priority, mission, type, date,
+                                                       checksum, checksum_algorithm, size)
+                                VALUES (:id, :download_url, :target, :priority, :mission, :type, :date,
+                                        :checksum, :checksum_algorithm, :size)"""
+flag_queued_candidates = """UPDATE queue_candidates
+                                SET new=0
+                                WHERE EXISTS (SELECT 1 FROM L2_files WHERE L2_files.id=queue_candidates.id)"""
+queue_L3m_candidates = """  INSERT OR IGNORE
+                                INTO L3m_files (id, file_status, mission, type, date)
+                                SELECT DISTINCT target, 0, mission, type, date
+                                    FROM queue_candidates
+                                    WHERE new=1"""
+queue_L2_candidates = """   INSERT INTO L2_files (id, download_url, target, file_status, priority, mission, type, date,
+                                                  checksum, checksum_algorithm, size)
+                                SELECT id, download_url, target, 0, priority, mission, type, date,
+                                       checksum, checksum_algorithm, size
+                                    FROM queue_candidates
+                                    WHERE new=1"""
+count_new_candidates = """  SELECT COUNT(*)
+                                FROM queue_candidates
+                                WHERE new=1"""
+# an existing L2 file is 'processed' (2) if its target exists, and 'unprocessed' (1) otherwise
+insert_L2_existing = """INSERT OR IGNORE
+                            INTO L2_files (id, location, target, file_status, priority, mission, type, date)
+                            VALUES (:id, :location, :target,
+                                    CASE WHEN EXISTS (SELECT 1 FROM L3m_files WHERE id=:target AND file_status>0)
+                                        THEN 2 ELSE 1 END,
+                                    :priority, :mission, :type, :date)"""
+# a L3m file produced alongside a target, which may not have been queued
+insert_L3m_output = """ INSERT OR IGNORE
+                            INTO L3m_files (id, file_status, mission, type, date)
+                            VALUES (:id, 0, :mission, :type, :date)"""
+insert_L3m_existing = """   INSERT or REPLACE
+                                INTO L3m_files (id, location, file_status, mission, type, date)
+                                VALUES (:id, :location, 1, :mission, :type, :date)"""
+
 update_L3m = """ UPDATE L3m_files
                    SET file_status = 1, location = '{0}'
                    WHERE id = '{1}'
@@ -97,33 +257,112 @@ update_L3m = """ UPDATE L3m_files
 
 # updating queries
 file_downloaded = """   UPDATE L2_files
-                            SET location='{1}', file_status=1, created_at='{2}'
-                            WHERE id='{0}'"""
+                            SET location=:location, file_status=1, created_at=:created_at
+                            WHERE id=:id"""
 file_produced = """ UPDATE L3m_files
-                        SET location='{1}', file_status=1, created_at='{2}'
-                        WHERE id='{0}'"""
+                        SET location=:location, file_status=1, created_at=:created_at
+                        WHERE id=:id"""
 update_status = """ UPDATE {0}
-                        SET file_status={2}
-                        WHERE id='{1}'"""
+                        SET file_status=:status
+                        WHERE id=:id"""
 update_priority = """ UPDATE {0}
                          SET priority={2}
                          WHERE id='{1}'"""
-verify_file = """   UPDATE {0}
-                        SET verifier_bit=1
-                        WHERE id='{1}'"""
-reset_verifier = """UPDATE {0}
-                        SET verifier_bit=0"""
+# disk usage ledger queries
+get_disk_usage = """SELECT bytes
+                        FROM disk_usage
+                        WHERE id=0"""
+add_disk_usage = """UPDATE disk_usage
+                        SET bytes=bytes+:delta
+                        WHERE id=0"""
+# the ledger is set to the measured size, plus whatever was recorded while measuring
+reconcile_disk_usage = """  INSERT OR REPLACE
+                                INTO disk_usage (id, bytes, reconciled_at)
+                                VALUES (0, :measured + COALESCE((SELECT bytes FROM disk_usage WHERE id=0) - :recorded, 0), :reconciled_at)"""
+
 # deleting files
 delete_L2file = """ DELETE FROM L2_files WHERE id='{0}'"""
+delete_L2_files = """   DELETE FROM L2_files WHERE id=:id"""
+
+# date range operations, answered from the date indexes. {0} is the table and {1} the condition, see RangeCondition
+select_in_range = """   SELECT id, file_status, location
+                            FROM {0}
+                            WHERE {1}
+                            ORDER BY date, id"""
+update_priority_in_range = """  UPDATE {0}
+                                    SET priority=:priority
+                                    WHERE {1}"""
+update_status_in_range = """UPDATE {0}
+                                SET file_status=:status
+                                WHERE {1}"""
+
+
+# connection settings applied to every new connection
+connection_pragmas = """
+PRAGMA journal_mode={0};
+PRAGMA synchronous=NORMAL;
+PRAGMA foreign_keys=ON;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-{1}"""
+
+# every thread keeps its own connection to each database open for its whole lifetime
+local = threading.local()
+
+# the schema of each database is brought up to date once per process, by the first connection
+schema_lock = threading.Lock()
+ready_schemas = set()
+
+
+# returns the calling thread's connection to the given database (by default the File Management Database), opening it on first use
+def GetConnection(database=None):
+    database = database or params.db_filename
+    if not hasattr(local, "conns"):
+        local.conns = dict()
+
+    conn = local.conns.get(database)
+    if conn is None:
+        conn = sqlite3.connect(params.path_to_data + database,
+                               timeout=params.db_busy_timeout,
+                               isolation_level=None)
+        for pragma in connection_pragmas.format(params.db_journal_mode,
+                                                params.db_cache_size * 1024).split(';'):
+            conn.execute(pragma)
+        local.conns[database] = conn
+
+        with schema_lock:
+            if database not in ready_schemas:
+                ready_schemas.add(database)
+                if database == params.cmr_cache_filename:
+                    Execute(create_cmr_cache, database=database)
+                else:
+                    CreateTables()
+    return conn
+
+
+# closes the calling thread's connection to the given database, if it has one
+def CloseConnection(database=None):
+    database = database or params.db_filename
+    conn = getattr(local, "conns", dict()).pop(database, None)
+    if conn is not None:
+        conn.close()
 
 
 # execute a given query, and return a value according to the return_type argument
-def Execute(query, return_type=None):
+# parameters, if given, are bound to every command in the query
+def Execute(query, return_type=None, parameters=(), database=None):
+    retval = None
     try:
         # preparation
-        conn = sqlite3.connect(params.path_to_data + params.db_filename, isolation_level=None)
+        conn = GetConnection(database)
         cur = conn.cursor()
-        cur.execute("BEGIN")
+
+        # writing transactions take the write lock up front, so that they wait for it (busy_timeout)
+        # instead of failing with "database is locked" when upgrading from a read lock
+        if query.lstrip().upper().startswith("SELECT"):
+            cur.execute("BEGIN")
+        else:
+            cur.execute("BEGIN IMMEDIATE")
+
         # breaking query into commands
         commands = query.split(';')
 
@@ -131,13 +370,15 @@ def Execute(query, return_type=None):
             # execute all commands
             for com in commands:
                 # print("Executing", com)
-                cur.execute(com)
+                cur.execute(com, parameters)
 
             # decide on return value
             if return_type is None:
                 retval = None
             elif return_type == "scalar":
                 retval = cur.fetchone()[0]
+            elif return_type == "rowcount":
+                retval = cur.rowcount
             else:
                 retval = cur.fetchall()
 
@@ -147,16 +388,83 @@ def Execute(query, return_type=None):
             print("Error while processing transaction:", com, error)
             cur.execute("ROLLBACK")
 
-        conn.close()
+        # the connection outlives this call, so never leave a transaction open on it
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
 
     except sqlite3.Error as error:
         print("Error while connecting to database:", error)
-        conn.close()
+        CloseConnection(database)
         exit("Program terminated.")
 
     return retval
 
 
+# execute a list of (query, rows) pairs in a single transaction, each query being run once per row with bound parameters
+def ExecuteMany(statements, database=None):
+    try:
+        conn = GetConnection(database)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+
+        try:
+            for query, rows in statements:
+                cur.executemany(query, rows)
+            cur.execute("COMMIT")
+
+        except conn.Error as error:
+            print("Error while processing transaction:", query, error)
+            cur.execute("ROLLBACK")
+
+        # the connection outlives this call, so never leave a transaction open on it
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+    except sqlite3.Error as error:
+        print("Error while connecting to database:", error)
+        CloseConnection(database)
+        exit("Program terminated.")
+
+
+# returns the current time, formatted for the created_at columns
+def Now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M")
+
+
+# creates the tables if needed, and migrates tables created by older versions of this file
+def CreateTables():
+    Execute(create_tables)
+
+    for table in ["L2_files", "L3m_files"]:
+        # add the missing columns
+        existing_columns = [column[1] for column in Execute(get_columns.format(table), "list")]
+        for column, column_type in added_columns[table]:
+            if column not in existing_columns:
+                Execute(add_column.format(table, column, column_type))
+
+        # fill them in for rows inserted before they existed
+        entries = []
+        for item in Execute(select_unparsed.format(table), "list"):
+            try:
+                entries.append(AddProperties({"id": item[0]}))
+            except (ValueError, KeyError, IndexError):
+                continue # not an OBPG filename
+        ExecuteMany([(set_parsed_columns.format(table), entries)])
+
+    Execute(create_indexes)
+
+
+# adds the mission, type and date parsed from the entry's filename to the entry
+def AddProperties(entry):
+    p = util.GetFileProperties(entry["id"])
+    entry["mission"] = p.identifier
+    entry["type"] = p.type
+    entry["date"] = p.day
+    return entry
+
+
 # checks if an entry exists in the specified table
 def Exists(table, entry):
     return bool(Execute(count_files.format(table, entry), "scalar"))
@@ -174,7 +482,7 @@ def FilenameToDict(filename, location):
          }
 
     p = util.GetFileProperties(filename)
-    if p["level"] == "L2":
+    if p.level == "L2":
         d["target"] = util.ProduceL3mFilename(filename)
 
     return d
@@ -199,45 +507,65 @@ def UpdateL3m(location, filename):
 
 # insert a L3m file into the database
 def InsertL3m(entry):
+    AddProperties(entry)
     query = insert_L3m.format(*FormatEntry(entry))
     Execute(query)
 
 
+# insert existing L3m files into the database, in a single transaction
+def InsertL3mFiles(entries):
+    for entry in entries:
+        AddProperties(entry)
+    ExecuteMany([(insert_L3m_existing, entries)])
+
+
 # insert an existing L2 file into the database
 def InsertL2(entry):
-    # check if a target L3m entry exists
+    InsertL2Files([entry])
 
-    # if so, insert the L2 entry with file_status=2 ('processed')
-    if ExistsOnDisk("L3m_files", entry["target"]):
-        entry["file_status"] = 2
-        Execute(insert_L2_processed.format(*FormatEntry(entry)))
 
-    # otherwise, insert the L2 entry with file_status=1 ('unprocessed') and insert a L3m entry with file_status=0 ('missing')
-    else:
-        entry["file_status"] = 1
-        L3m_entry = {"id": entry["target"], "file_status": 0}
-        Execute(insert_L2_unprocessed.format(*FormatEntry(entry), *FormatEntry(L3m_entry)))
+# insert existing L2 files into the database, in a single transaction
+# each L2 file is inserted with file_status=2 ('processed') if its target L3m exists,
+# otherwise with file_status=1 ('unprocessed') and its target L3m is inserted with file_status=0 ('missing')
+def InsertL2Files(entries):
+    for entry in entries:
+        AddProperties(entry)
+    ExecuteMany([(queue_L3m, entries), (insert_L2_existing, entries)])
 
 
-# insert files from a certain type and from a certain folder into the DB
-def InsertFiles(path, filetype):
+# collect the entries of all files from a certain folder, recursively
+def CollectFiles(path, filetype, entries):
     filelist = os.listdir(path)
     for item in filelist:
 
         # if the item is a directory, go through it recursively
         if os.path.isdir(path + item):
-            InsertFiles(path + item + '/', filetype)
+            CollectFiles(path + item + '/', filetype, entries)
+
+        # skip partial downloads, they are resumed by the downloader
+        elif item.endswith(util.PART_SUFFIX):
+            continue
 
-        # else, try inserting the file
+        # else, add the file's entry
         else:
             db_entry = FilenameToDict(item, path)
 
             if filetype == "L2":
                 db_entry["priority"] = 4  # the default priority for L2 files that already exist
-                InsertL2(db_entry)
-            else:
-                db_entry["file_status"] = 1
-                InsertL3m(db_entry)
+
+            entries.append(db_entry)
+
+    return entries
+
+
+# insert files from a certain type and from a certain folder into the DB
+def InsertFiles(path, filetype):
+    entries = CollectFiles(path, filetype, [])
+
+    if filetype == "L2":
+        InsertL2Files(entries)
+    else:
+        InsertL3mFiles(entries)
 
 
 # get all existing files from a table
@@ -245,41 +573,97 @@ def GetExisting(table):
     return [item[0] for item in Execute(select_existing.format(table), "list")]
 
 
+# get the dates between start and end (datetimes) for which L3m data of the given mission (e.g. AQUA_MODIS) and type exists
+def GetCoveredDates(mission, type, start, end):
+    parameters = {"mission": mission, "type": type, "start": start.strftime("%Y%m%d"), "end": end.strftime("%Y%m%d")}
+    return [datetime.strptime(date, "%Y%m%d") for date, in Execute(select_covered_dates, "list", parameters)]
+
+
 # get <limit> files that are ready to be downloaded
 def GetReadyForDownload(limit):
     return Execute(select_ready_for_download.format(limit), "list")
 
 
+# get those of the given files that are queued up for downloading
+def GetQueued(filenames):
+    filenames = list(filenames)
+    return Execute(select_queued.format(','.join('?' * len(filenames))), "list", filenames)
+
+
 # gets filestatus
 def GetFileStatus(table, filename):
     return Execute(get_file_status.format(table, filename))
 
 
-# gets all the unverified files 
-def GetUnverifiedExisting(table):
-    return Execute(select_unverified_existing.format(table))
-
-
 # queue up a L2 file to be downloaded
 def QueueFile(entry):
-    entry["file_status"] = 0
-    L3m_entry = {"id": entry["target"], "file_status": 0}
-    Execute(insert_L2_unprocessed.format(*FormatEntry(entry), *FormatEntry(L3m_entry)))
+    QueueFiles([entry])
+
+
+# queue up a list of L2 files to be downloaded, in a single transaction, skipping those that are already in the database
+# every entry is a dictionary with the keys id, download_url, target and priority,
+# and optionally the checksum, checksum_algorithm and size of the file, as given by CMR
+# returns the number of files that were queued
+def QueueFiles(entries):
+    for entry in entries:
+        AddProperties(entry)
+        for key in ["checksum", "checksum_algorithm", "size"]:
+            entry.setdefault(key, None)
+
+    # the temporary table belongs to this thread's connection, and stays there between calls
+    Execute(create_queue_candidates)
+    ExecuteMany([
+        (clear_queue_candidates, [()]),
+        (insert_queue_candidate, entries),
+        (flag_queued_candidates, [()]),
+        (queue_L3m_candidates, [()]),
+        (queue_L2_candidates, [()])
+        ])
+    return Execute(count_new_candidates, "scalar")
 
 
 # update the entry concerning the specified L2 file, when it has been downloaded
 def FileDownloaded(filename, location):
-    Execute(file_downloaded.format(filename, location, datetime.now().strftime("%Y-%m-%d %H:%M")))
+    FilesDownloaded([(filename, location)])
+
+
+# update the entries concerning a list of (filename, location) L2 pairs, when they have been downloaded
+def FilesDownloaded(files):
+    now = Now()
+    ExecuteMany([(file_downloaded, [{"id": f, "location": l, "created_at": now} for f, l in files])])
 
 
 # update the entry concerning the specified L3m file, when it has been produced
 def FileProduced(filename, location):
-    Execute(file_produced.format(filename, location, datetime.now().strftime("%Y-%m-%d %H:%M")))
+    FilesProduced([(filename, location)])
+
+
+# update the entries concerning a list of (filename, location) L3m pairs, when they have been produced
+def FilesProduced(files):
+    now = Now()
+    ExecuteMany([(file_produced, [{"id": f, "location": l, "created_at": now} for f, l in files])])
+
+
+# mark a batch of L2 files as processed (2) and the L3m files produced from them (their target and any other outputs) as produced,
+# in a single transaction. size_delta is the change in the data folder's size caused by processing them
+def FilesProcessed(L2_filenames, L3m_filenames, location, size_delta=0):
+    now = Now()
+    ExecuteMany([
+        (update_status.format("L2_files"), [{"id": f, "status": 2} for f in L2_filenames]),
+        (insert_L3m_output, [AddProperties({"id": f}) for f in L3m_filenames]),
+        (file_produced, [{"id": f, "location": location, "created_at": now} for f in L3m_filenames]),
+        (add_disk_usage, [{"delta": size_delta}])
+        ])
 
 
 # update the given file's status in the given table
 def UpdateStatus(table, filename, status):
-    Execute(update_status.format(table, filename, status))
+    UpdateStatuses(table, [filename], status)
+
+
+# update the status of a list of files in the given table, in a single transaction
+def UpdateStatuses(table, filenames, status):
+    ExecuteMany([(update_status.format(table), [{"id": f, "status": status} for f in filenames])])
 
 
 # update the give file's priority in the given table
@@ -287,24 +671,54 @@ def UpdatePriority(table, filename, priority):
     Execute(update_priority.format(table, filename, priority))
 
 
-# set verifier_bit to 1
-def VerifyFile(table, filename):
-    Execute(verify_file.format(table, filename))
+# get the status and location of every file in the given table, as a {filename: (status, location)} dictionary
+# for L2 files, the target is added as well: {filename: (status, location, target)}
+def GetFileRecords(table):
+    query = select_L2_records if table == "L2_files" else select_L3m_records
+    return {row[0]: row[1:] for row in Execute(query, "list")}
+
+
+# apply the fixes found by the verifier, in a single transaction. all arguments are lists:
+# new_* - (filename, location) of files on the disk that aren't in the database
+# found_* - (filename, location) of files on the disk that are listed as missing, or in another location
+# lost_* - filenames of files listed as existing that aren't on the disk
+# processed_L2 - filenames of L2 files listed as unprocessed, whose target exists
+def ApplyVerification(new_L3m, found_L3m, lost_L3m, new_L2, found_L2, lost_L2, processed_L2):
+    now = Now()
+    new_L2 = [AddProperties({"id": f, "location": l, "target": util.ProduceL3mFilename(f), "priority": 4}) for f, l in new_L2]
+    ExecuteMany([
+        (insert_L3m_existing, [AddProperties({"id": f, "location": l}) for f, l in new_L3m]),
+        (file_produced, [{"id": f, "location": l, "created_at": now} for f, l in found_L3m]),
+        (update_status.format("L3m_files"), [{"id": f, "status": 0} for f in lost_L3m]),
+        (queue_L3m, new_L2),
+        (insert_L2_existing, new_L2),
+        (file_downloaded, [{"id": f, "location": l, "created_at": now} for f, l in found_L2]),
+        (update_status.format("L2_files"), [{"id": f, "status": 0} for f in lost_L2]),
+        (update_status.format("L2_files"), [{"id": f, "status": 2} for f in processed_L2])
+        ])
+
+
+# claim up to <limit> batches of L2 files that share a target and are all ready for processing, by priority, for the given worker
+# targets leased by other workers are skipped. returns a list of (target, [L2 filenames]) pairs
+def ClaimReadyBatches(worker, limit):
+    now = time.time()
+    parameters = {"worker": worker, "now": now, "expires_at": now + params.lease_duration*60}
+    return [(target, sorted(ids.split(','))) for target, ids in Execute(claim_ready_targets.format(int(limit)), "list", parameters)]
 
 
-# set all files's verifier_bit to 0
-def ResetVerifier(table):
-    Execute(reset_verifier.format(table))
+# extend the leases of all the targets claimed by the given worker
+def RenewLeases(worker):
+    Execute(renew_leases, parameters={"worker": worker, "expires_at": time.time() + params.lease_duration*60})
 
 
-# get all files that fullfill verifier_bit=0 AND file_status>0:
-def GetUnverifiedExisting(table):
-    return [item[0] for item in Execute(select_unverified_existing.format(table), "list")]
+# give up the given worker's claim on a target, once it has been processed or failed
+def ReleaseLease(worker, target):
+    Execute(release_lease, parameters={"worker": worker, "target": target})
 
 
-# get all files that are ready for processing
-def GetFilesReadyForProcessing():
-    return Execute(select_ready_for_processing, "list")
+# give up all of the given worker's claims
+def ReleaseLeases(worker):
+    Execute(release_leases, parameters={"worker": worker})
 
 
 def GetFileLocation(table, filename):
@@ -316,8 +730,103 @@ def ThereAreUnprocessedFiles():
     return bool(Execute(count_unprocessed_files, "scalar"))
 
 
+# get the cached CMR result pages of a search, as a list of (page_num, hits, granules, cached_at) tuples
+def GetCachedPages(shortname, temporal, page_size):
+    return Execute(select_cached_pages, "list", (shortname, temporal, page_size), database=params.cmr_cache_filename)
+
+
+# replace the cached CMR result pages of a search. pages is a list of (hits, granules) pairs, granules being a JSON string
+def CachePages(shortname, temporal, page_size, pages, cached_at):
+    key = {"shortname": shortname, "temporal": temporal, "page_size": page_size}
+    rows = [dict(key, page_num=i+1, hits=hits, granules=granules, cached_at=cached_at) for i, (hits, granules) in enumerate(pages)]
+    ExecuteMany([(delete_cached_pages, [key]), (insert_cached_page, rows)], database=params.cmr_cache_filename)
+
+
+# mark the cached CMR result pages of a search as up to date
+def TouchCachedPages(shortname, temporal, page_size, cached_at):
+    Execute(touch_cached_pages, parameters=(cached_at, shortname, temporal, page_size), database=params.cmr_cache_filename)
+
+
+# clear the CMR cache, for a single shortname or entirely
+def ClearCache(shortname=None):
+    if shortname:
+        Execute(clear_cached_shortname, parameters=(shortname,), database=params.cmr_cache_filename)
+    else:
+        Execute(clear_cached_pages, database=params.cmr_cache_filename)
+
+
+# get the size of the data folder, as recorded in the ledger. returns None if it was never measured
+def GetDiskUsage():
+    rows = Execute(get_disk_usage, "list")
+    return rows[0][0] if rows else None
+
+
+# record a change in the size of the data folder
+def AddDiskUsage(delta):
+    ExecuteMany([(add_disk_usage, [{"delta": delta}])])
+
+
+# correct the ledger with a measurement of the data folder's size
+# recorded is what the ledger said when the measurement started, so that changes recorded while measuring are kept
+def ReconcileDiskUsage(measured, recorded):
+    ExecuteMany([(reconcile_disk_usage, [{"measured": measured, "recorded": recorded, "reconciled_at": Now()}])])
+
+
+# returns the condition and parameters selecting the files dated between start and end (datetimes, inclusive),
+# optionally only of the given missions (identifiers, e.g. AQUA_MODIS), and only the existing ones (status above 0)
+def RangeCondition(start, end, missions=None, existing=False):
+    condition = "date BETWEEN :start AND :end"
+    parameters = {"start": start.strftime("%Y%m%d"), "end": end.strftime("%Y%m%d")}
+    if existing:
+        condition += " AND file_status>0"
+    if missions:
+        condition += " AND mission IN ({0})".format(','.join(f":mission{i}" for i in range(len(missions))))
+        parameters.update({f"mission{i}": mission for i, mission in enumerate(missions)})
+    return condition, parameters
+
+
+# get the (id, file_status, location) of all files in the given table from the given dates and missions
+# if existing is set, only the files with a status above 0 (existing ones) are returned
+def SelectInRange(table, start, end, missions=None, existing=False):
+    condition, parameters = RangeCondition(start, end, missions, existing)
+    return Execute(select_in_range.format(table, condition), "list", parameters)
+
+
+# set the priority of all files in the given table from the given dates and missions, in a single statement
+# if existing is set, only the files with a status above 0 (existing ones) are updated
+# returns the number of files updated
+def UpdatePriorityInRange(table, start, end, priority, missions=None, existing=False):
+    condition, parameters = RangeCondition(start, end, missions, existing)
+    parameters["priority"] = priority
+    return Execute(update_priority_in_range.format(table, condition), "rowcount", parameters)
+
+
+# set the status of all files in the given table from the given dates and missions, in a single statement
+# if existing is set, only the files with a status above 0 (existing ones) are updated
+# returns the number of files updated
+def UpdateStatusInRange(table, start, end, status, missions=None, existing=False):
+    condition, parameters = RangeCondition(start, end, missions, existing)
+    parameters["status"] = status
+    return Execute(update_status_in_range.format(table, condition), "rowcount", parameters)
+
+
+# delete a list of L2 files, given as (filename, full path) pairs, from the disk and from the database, in a single transaction
+def DeleteFiles(files):
+    freed = 0
+    for filename, fullpath in files:
+        freed += os.path.getsize(fullpath)
+        os.remove(fullpath)
+    ExecuteMany([
+        (delete_L2_files, [{"id": filename} for filename, fullpath in files]),
+        (add_disk_usage, [{"delta": -freed}])
+        ])
+
+
+# delete a L2 file (given by its full path) from the disk and from the database
 def DeleteSpecificFile(location, filename):
-    os.remove(location, filename, dir_fd=none)
+    size = os.path.getsize(location)
+    os.remove(location)
+    AddDiskUsage(-size)
     return Execute(delete_L2file.format(filename))
 
 
@@ -325,7 +834,7 @@ if __name__ == "__main__":
     # if run as its own script, this produces the File Management Database
 
     # create file and tables
-    Execute(create_tables)
+    CreateTables()
 
     # cycle through all files in the data directory recursively and insert them into the DB (if they aren't there already)
     # this ordering is important, as inserting L2 files will check whether L3m files are in the database, and not on the disk itself.
@@ -10,6 +10,8 @@ from os import listdir
 from os.path import isfile, join
 
 from datetime import datetime
+from collections import namedtuple
+from functools import lru_cache
 
 import params
 
@@ -25,6 +27,9 @@ j - JPSS1_VIIRS
 n - SNPP_VIIRS
 Your answer: """
 
+# files being downloaded are written under their final name with this suffix
+PART_SUFFIX = ".part"
+
 # sensor identifiers
 ID_TO_NAME = {
     "A": "AQUA_MODIS",
@@ -49,9 +54,29 @@ TYPE_TO_PRODUCT = {
     "SST": "sst"
     }
 
+# l3mapgen resolutions -> l2bin resolution codes, finest first
+BINNING_RESOLUTION = {
+    "qkm": "Q",
+    "hkm": "H",
+    "1km": "1",
+    "2km": "2",
+    "4km": "4",
+    "9km": "9",
+    "18km": "18",
+    "36km": "36"
+    }
+
 PAGE_SIZE = 800
 
+FILE_PROPERTIES_CACHE_SIZE = 2**16 # filenames
+
+# OBPG file properties. day is the date as YYYYMMDD, and period, resolution and product are None for L2 files
+FileProperties = namedtuple("FileProperties",
+                            ["mission", "sensor", "identifier", "date", "day", "level", "type", "period", "resolution", "product"])
+
 # Returns OBPG file properties (mission, sensor, date, level and data type)
+# the results are immutable, so they are cached, as the same names are parsed over and over
+@lru_cache(maxsize=FILE_PROPERTIES_CACHE_SIZE)
 def GetFileProperties(filename_with_extension):
 
     filename, ext = os.path.splitext(filename_with_extension)
@@ -59,36 +84,50 @@ def GetFileProperties(filename_with_extension):
     components = filename.split('.')
     
     mission, sensor = components[0].split('_')
-    date = components[1][:8]
+    day = components[1][:8]
+    date = datetime(int(day[:4]), int(day[4:6]), int(day[6:8]))
     level = components[2]
     
-    properties = {
-        "mission": mission,
-        "sensor": sensor,
-        "identifier": mission+'_'+sensor,
-        "date": datetime.strptime(date, "%Y%m%d"),
-        "level": level
-    }
-    
     # some properties are only relevant for L3 data
     if level == "L2":
-        properties["type"] = components[3] # usually OC or SST
-    else:
-        properties["period"] = components[3] # usually DAY
-        properties["type"] = components[4] # usually OC or SST
-        properties["resolution"] = components[5] # usually 1km
-    
-    return properties
+        return FileProperties(mission, sensor, mission+'_'+sensor, date, day, level,
+                              components[3], # usually OC or SST
+                              None, None, None)
+
+    data_type = components[4] # usually OC or SST
+    product = None
+    if level == "L3m": # only named when it isn't the type's usual product
+        product = components[6] if len(components) > 6 else TYPE_TO_PRODUCT.get(data_type)
+    return FileProperties(mission, sensor, mission+'_'+sensor, date, day, level, data_type,
+                          components[3], # usually DAY
+                          components[5], # usually 1km
+                          product)
+
+# Returns the properties of a list of files, in the same order
+def GetFilesProperties(filenames):
+    return list(map(GetFileProperties, filenames))
+
+# the products that need to be binned for the given type
+def BinnedProducts(type):
+    return list(dict.fromkeys(product for product, resolution in params.L3m_outputs[type]))
+
+# the resolution the given type is binned at - the finest of its L3m outputs
+def BinnedResolution(type):
+    resolutions = {resolution for product, resolution in params.L3m_outputs[type]}
+    return next(resolution for resolution in BINNING_RESOLUTION if resolution in resolutions)
 
 def ProduceL3bFilename(L2_filename):
     p = GetFileProperties(L2_filename)
-    p["date"] = p["date"].strftime("%Y%m%d")
-    return f"{p['mission']}_{p['sensor']}.{p['date']}.L3b.DAY.{p['type']}.{params.resolution}.nc"
+    return f"{p.identifier}.{p.day}.L3b.DAY.{p.type}.{BinnedResolution(p.type)}.nc"
 
-def ProduceL3mFilename(L2_filename):
+# product and resolution default to the type's first L3m output, i.e. the L2 file's target
+def ProduceL3mFilename(L2_filename, product=None, resolution=None):
     p = GetFileProperties(L2_filename)
-    p["date"] = p["date"].strftime("%Y%m%d")
-    return f"{p['mission']}_{p['sensor']}.{p['date']}.L3m.DAY.{p['type']}.{params.resolution}.nc"
+    default_product, default_resolution = params.L3m_outputs[p.type][0]
+    product = product or default_product
+    resolution = resolution or default_resolution
+    suffix = "" if product == TYPE_TO_PRODUCT[p.type] else "." + product
+    return f"{p.identifier}.{p.day}.L3m.DAY.{p.type}.{resolution}{suffix}.nc"
 
 # gets all file paths from the directory and sub directories 
 def getListOfFiles(path):
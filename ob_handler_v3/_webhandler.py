@@ -10,10 +10,10 @@ This file contains functions that deal with web accesses, from API calls to down
 
 # local imports
 import _util as util
+import _sqlhandler as sql
 import params
 
 # external
-from urllib.request import urlopen
 from urllib.parse import urlparse
 from math import ceil
 import pprint
@@ -21,83 +21,185 @@ import json
 import argparse
 import os
 import re
+import bz2
+import zlib
+import hashlib
 import sys
 import subprocess
 import logging
+import threading
 import requests
 from requests.adapters import HTTPAdapter
 from datetime import datetime
 import time
 import textwrap
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # download parameters - do not touch!
 DEFAULT_CHUNK_SIZE = 131072
+PART_SUFFIX = util.PART_SUFFIX # files being downloaded are written under their final name with this suffix
+INCOMPLETE = -1 # status returned when a download ended before the whole file arrived
+STREAM_DECOMPRESSED = {'.gz', '.bz2'} # compression methods undone while downloading, rather than afterwards
+CHECKSUM_MISMATCH = -2 # status returned when a downloaded file doesn't match its checksum or size
+
+# CMR checksum algorithm names -> hashlib names
+CHECKSUM_ALGORITHMS = {"MD5": "md5", "SHA-1": "sha1", "SHA-256": "sha256", "SHA-384": "sha384", "SHA-512": "sha512"}
 obpgSession = None # requests session object used to keep connections around
+sessionLock = threading.Lock() # the session is shared by all downloading threads
+hostSlots = {} # server -> semaphore limiting the number of concurrent connections to it
+
+# search parameters
+CMR_URL = "https://cmr.earthdata.nasa.gov/search/granules.umm_json"
+cmrSession = None # requests session object used for keep-alive (gzipped) connections to CMR
+cmrSlots = threading.BoundedSemaphore(params.cmr_threads) # limits the number of concurrent CMR requests
+
+# get a single page of CMR search results for the provided shortname and timespan
+# if updated_since is given, only granules revised since then are counted
+def GetCMRPage(shortname, timespan, page_num, page_size=util.PAGE_SIZE, updated_since=None):
+    query = {
+        "page_size": page_size,
+        "page_num": page_num,
+        "short_name": shortname,
+        "provider": "OB_DAAC",
+        "temporal": timespan
+        }
+    if updated_since:
+        query["updated_since"] = updated_since
+
+    with cmrSlots:
+        response = getCMRSession().get(CMR_URL, params=query, timeout=params.cmr_timeout)
+    search_results = response.json()
+
+    if search_results.get("items") is None:
+        print("Unexpected error occured. No items were found.")
+        pprint.pprint(search_results)
+        exit("Program terminated")
+
+    return search_results
+
+# extract what we keep about a granule from its CMR (UMM) record: its download URL, and its checksum and size if given
+def GranuleFromUMM(item):
+    granule = {"url": item["umm"]["RelatedUrls"][0]["URL"]}
+
+    # the information about the distributed file, preferably the one named like the URL
+    files = item["umm"].get("DataGranule", {}).get("ArchiveAndDistributionInformation", [])
+    files = [f for f in files if f.get("Name") == granule["url"].split('/')[-1]] or files
+    if files:
+        checksum = files[0].get("Checksum", {})
+        if checksum.get("Algorithm") in CHECKSUM_ALGORITHMS:
+            granule["checksum"] = checksum["Value"].lower()
+            granule["checksum_algorithm"] = CHECKSUM_ALGORITHMS[checksum["Algorithm"]]
+        if "SizeInBytes" in files[0]:
+            granule["size"] = files[0]["SizeInBytes"]
+
+    return granule
+
+# fetch all the CMR search results for the provided shortname and timespan, as a list of (hits, granules) pages
+def FetchGranulePages(shortname, timespan):
+
+    # the first page also tells how many pages there are
+    first_page = GetCMRPage(shortname, timespan, 1)
+    n_pages = ceil(first_page["hits"]/util.PAGE_SIZE)
+
+    # fetch the rest of the pages concurrently
+    with ThreadPoolExecutor(params.cmr_threads) as pool:
+        pages = [first_page] + list(pool.map(lambda i: GetCMRPage(shortname, timespan, i), range(2, n_pages+1)))
+
+    return [(page["hits"], [GranuleFromUMM(item) for item in page["items"]]) for page in pages]
+
+# returns True if CMR reports that the results of the search haven't changed since the given time
+def SearchUnchanged(shortname, timespan, hits, since):
+    updated_since = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since))
+    revised = GetCMRPage(shortname, timespan, 1, page_size=0, updated_since=updated_since)["hits"]
+    return revised == 0 and GetCMRPage(shortname, timespan, 1, page_size=0)["hits"] == hits
+
+# get the cached pages of a search, if the cache holds all of them. returns None otherwise
+def GetCompleteCachedPages(shortname, timespan):
+    cached = sql.GetCachedPages(shortname, timespan, util.PAGE_SIZE)
+    if cached and len(cached) == max(1, ceil(cached[0][1]/util.PAGE_SIZE)):
+        return cached
+    return None
+
+# get the CMR search results for the provided shortname and timespan, as a list of (hits, granules) pages
+# results are served from the on-disk cache while it is younger than params.cmr_cache_ttl,
+# or after that, as long as CMR reports that no granules were added, removed or revised since they were cached
+def GetGranulePages(shortname, timespan):
+    cached = GetCompleteCachedPages(shortname, timespan)
+    if cached:
+        now = time.time()
+        cached_at = min(page[3] for page in cached)
+        if now - cached_at < params.cmr_cache_ttl*3600:
+            return [(page[1], json.loads(page[2])) for page in cached]
+        if SearchUnchanged(shortname, timespan, cached[0][1], cached_at):
+            sql.TouchCachedPages(shortname, timespan, util.PAGE_SIZE, now)
+            return [(page[1], json.loads(page[2])) for page in cached]
+
+    # the time is taken before fetching, so that changes made while fetching are caught by the next revalidation
+    fetched_at = time.time()
+    pages = FetchGranulePages(shortname, timespan)
+    sql.CachePages(shortname, timespan, util.PAGE_SIZE, [(hits, json.dumps(granules)) for hits, granules in pages], fetched_at)
+    return pages
 
 # get the number of L2 files corresponding to the provided shortname and timespan
 def GetNumberOfFiles(shortname, timespan):
-    request = f"https://cmr.earthdata.nasa.gov/search/granules.umm_json\
-?short_name={shortname}\
-&provider=OB_DAAC\
-&temporal={timespan}"
-
-    response = urlopen(request)
-    search_results = json.loads(response.read())
-
-    if search_results["items"] is None:
-        print("Unexpected error occured. No files were found.")
-        pprint.pprint(search_results)
-        exit("Program terminated")
+    cached = GetCompleteCachedPages(shortname, timespan)
+    if cached and time.time() - min(page[3] for page in cached) < params.cmr_cache_ttl*3600:
+        return cached[0][1]
+    return GetCMRPage(shortname, timespan, 1, page_size=0)["hits"]
 
-    return search_results["hits"]
+# get the L2 files corresponding to the provided shortname and timespan, as dictionaries (see GranuleFromUMM)
+def GetGranules(shortname, timespan):
+    return [granule for hits, granules in GetGranulePages(shortname, timespan) for granule in granules]
 
 # get the download URLs of L2 files corresponding to the provided shortname and timespan
 def GetDownloadURLs(shortname, timespan):
+    return [granule["url"] for granule in GetGranules(shortname, timespan)]
 
-    n_pages = ceil(GetNumberOfFiles(shortname, timespan)/util.PAGE_SIZE)
+# get the L2 files for several (shortname, timespan) requests concurrently
+# returns a dictionary mapping every request to its list of granules (see GranuleFromUMM)
+def SearchGranules(searches):
+    searches = list(searches)
+    with ThreadPoolExecutor(params.cmr_threads) as pool:
+        return dict(zip(searches, pool.map(lambda search: GetGranules(*search), searches)))
 
-    # page through the hits
-    hits = []
-    for i in range(1, n_pages+1):
+def getCMRSession():
+    global cmrSession
 
-        request = f"https://cmr.earthdata.nasa.gov/search/granules.umm_json\
-?page_size={util.PAGE_SIZE}\
-&page_num={i}\
-&short_name={shortname}\
-&provider=OB_DAAC\
-&temporal={timespan}"
-    
-        response = urlopen(request)
-        search_results = json.loads(response.read())
-    
-        if search_results["items"] is None:
-            print("Unexpected error occured. No items were found.")
-            pprint.pprint(search_results)
-            exit("Program terminated")
+    with sessionLock:
+        if not cmrSession:
+            cmrSession = requests.Session()
+            cmrSession.mount('https://', HTTPAdapter(max_retries=5, pool_maxsize=params.cmr_threads))
 
-        hits += [item["umm"]["RelatedUrls"][0]["URL"] for item in search_results["items"]]
-
-    return hits
+    return cmrSession
 
 def getSession(verbose=0, ntries=5):
     global obpgSession
 
-    if not obpgSession:
-        # turn on debug statements for requests
-        if verbose > 1:
-            print("Session started")
-            logging.basicConfig(level=logging.DEBUG)
+    with sessionLock:
+        if not obpgSession:
+            # turn on debug statements for requests
+            if verbose > 1:
+                print("Session started")
+                logging.basicConfig(level=logging.DEBUG)
 
-        obpgSession = requests.Session()
-        obpgSession.mount('https://', HTTPAdapter(max_retries=ntries))
+            obpgSession = requests.Session()
+            obpgSession.mount('https://', HTTPAdapter(max_retries=ntries,
+                                                      pool_maxsize=params.max_connections_per_host))
 
-    else:
-        if verbose > 1:
-            print("Reusing existing session")
+        else:
+            if verbose > 1:
+                print("Reusing existing session")
 
     return obpgSession
 
+# returns the semaphore limiting the number of concurrent connections to the given server
+def getHostSlot(server):
+    with sessionLock:
+        if server not in hostSlots:
+            hostSlots[server] = threading.BoundedSemaphore(params.max_connections_per_host)
+        return hostSlots[server]
+
 def isRequestAuthFailure(req) :
     ctype = req.headers.get('Content-Type')
     if ctype and ctype.startswith('text/html'):
@@ -105,9 +207,109 @@ def isRequestAuthFailure(req) :
             return True
     return False
 
+class BandwidthScheduler:
+    """
+    limits the download rate of all downloads together, using a token bucket per priority class
+    while a class is downloading it gets at least its reserved share of the rate,
+    and the rest of the rate (unreserved, or reserved by idle classes) is split evenly between the downloading classes
+    if the downloading classes reserved more than the whole rate together, their reserved shares are scaled down,
+    so that every downloading class keeps at least MIN_SHARE of the rate
+    """
+    ACTIVE_WINDOW = 2 # seconds - a class that hasn't downloaded anything for that long is idle
+    MIN_SHARE = 0.05 # fraction of the rate every downloading class gets, however much the others reserved
+    BURST = 1 # seconds worth of rate a class may save up while downloading slowly
+
+    def __init__(self, rate, shares):
+        self.lock = threading.Lock()
+        self.tokens = {} # priority -> bytes the class may download right away (negative while in debt)
+        self.last_update = {} # priority -> last time the class's tokens were updated
+        self.Configure(rate, shares)
+
+    # rate is in bytes per second (0 means unlimited), shares maps a priority to its reserved fraction of the rate
+    # may be called at any time, affecting downloads already in progress
+    # raises ValueError on a negative rate, or a share outside of 0-1
+    def Configure(self, rate, shares):
+        if rate < 0:
+            raise ValueError("Negative bandwidth " + str(rate))
+        for priority, share in shares.items():
+            if not 0 <= share <= 1:
+                raise ValueError("Invalid share " + str(share) + " for priority " + str(priority))
+
+        with self.lock:
+            self.rate = rate
+            self.shares = dict(shares)
+
+    # the rate the given class gets right now
+    def ClassRate(self, priority, now):
+        active = {p for p, t in self.last_update.items() if now - t < self.ACTIVE_WINDOW} | {priority}
+        reserved = sum(self.shares.get(p, 0) for p in active)
+        minimum = min(self.MIN_SHARE, 1 / len(active))
+        available = 1 - minimum * len(active)
+        scale = min(1, available / reserved) if reserved else 0
+        spare = (available - reserved * scale) / len(active)
+        return self.rate * (minimum + self.shares.get(priority, 0) * scale + spare)
+
+    # account for <nbytes> downloaded by a download of the given priority, sleeping as long as needed to keep within its rate
+    def Consume(self, priority, nbytes):
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            rate = self.ClassRate(priority, now)
+            saved = self.tokens.get(priority, 0) + (now - self.last_update.get(priority, now)) * rate
+            self.tokens[priority] = min(saved, rate * self.BURST) - nbytes
+            self.last_update[priority] = now
+            delay = -self.tokens[priority] / rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+# the bandwidth scheduler shared by all downloads
+bandwidth = BandwidthScheduler(params.max_bandwidth * 2**20, params.bandwidth_shares)
+
+class StreamDecompressor:
+    """
+    decompresses a gzip or bzip2 file chunk by chunk, as it is being downloaded
+    files made of several concatenated compressed streams are supported
+    """
+    def __init__(self, suffix):
+        self.suffix = suffix
+        self.decompressor = self.New()
+        self.complete = True # False while in the middle of a compressed stream
+
+    def New(self):
+        if self.suffix == '.bz2':
+            return bz2.BZ2Decompressor()
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    # raises zlib.error or OSError if the data isn't valid gzip or bzip2 data
+    def decompress(self, data):
+        output = []
+        while True:
+            if self.complete:
+                data = data.lstrip(b'\0') # zero padding between or after the streams is ignored, as gzip does
+            if not data:
+                break
+            output.append(self.decompressor.decompress(data))
+            self.complete = self.decompressor.eof
+            if not self.complete:
+                break
+            data = self.decompressor.unused_data
+            self.decompressor = self.New()
+        return b''.join(output)
+
+# the local name of a downloaded file - without the compression suffix if it is decompressed while downloading
+def LocalFilename(remote_name, uncompress):
+    if uncompress and Path(remote_name).suffix in STREAM_DECOMPRESSED:
+        return Path(remote_name).stem
+    return remote_name
+
+# checksum, if given, is a (hashlib algorithm, hex digest) pair the downloaded file must match, before decompression
+# expected_size, if given, is the size in bytes the downloaded file must have, before decompression
+# priority is the download's priority class in the bandwidth scheduler
 def httpdl(server, request, localpath='.', outputfilename=None, ntries=5,
            uncompress=False, timeout=30., verbose=0, force_download=False,
-           chunk_size=DEFAULT_CHUNK_SIZE):
+           chunk_size=DEFAULT_CHUNK_SIZE, checksum=None, expected_size=None, priority=None):
 
     status = 0
     urlStr = 'https://' + server + request
@@ -119,26 +321,53 @@ def httpdl(server, request, localpath='.', outputfilename=None, ntries=5,
     modified_since = None
     headers = {}
 
-    if not force_download:
-        if outputfilename:
-            ofile = localpath / outputfilename
-            modified_since = get_file_time(ofile)
-        else:
-            rpath = Path(request.rstrip())
-            if 'requested_files' in request:
-                rpath = Path(request.rstrip().split('?')[0])
-            ofile = localpath / rpath.name
-            if re.search(r'(?<=\?)(\w+)', ofile.name):
-                ofile = Path(ofile.name.split('?')[0])
+    # the name of the file on the server, until the server says otherwise
+    rpath = Path(request.rstrip())
+    if 'requested_files' in request:
+        rpath = Path(request.rstrip().split('?')[0])
+    remote_name = rpath.name.split('?')[0]
 
-            modified_since = get_file_time(ofile)
+    # outputfilename is the name of the file once downloaded (and decompressed)
+    ofile = localpath / (outputfilename or LocalFilename(remote_name, uncompress))
+
+    if not force_download:
+        modified_since = get_file_time(ofile)
 
         if modified_since:
             headers = {"If-Modified-Since":modified_since.strftime("%a, %d %b %Y %H:%M:%S GMT")}
 
-    with obpgSession.get(urlStr, stream=True, timeout=timeout, headers=headers) as req:
+    # the file is written to a .part file, and only renamed once complete
+    # if a previous attempt left a .part file behind, ask only for the rest of the file
+    # (unless it is decompressed while downloading - a decompressor can't pick up in the middle of a stream)
+    partfile = ofile.with_name(ofile.name + PART_SUFFIX)
+    resume_from = 0
+    if partfile.is_file() and not (uncompress and Path(remote_name).suffix in STREAM_DECOMPRESSED):
+        resume_from = partfile.stat().st_size
+    if resume_from:
+        headers["Range"] = "bytes=%d-" % resume_from
+
+    # the previous attempt downloaded the whole file, but stopped before renaming it
+    if resume_from and resume_from == expected_size and not (uncompress and Path(remote_name).suffix == '.Z'):
+        if checksum:
+            hasher = hashlib.new(checksum[0])
+            with open(partfile, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(chunk_size), b''):
+                    hasher.update(chunk)
+            if hasher.hexdigest() != checksum[1]:
+                print("Warning! %s doesn't match its checksum or size" % partfile.name)
+                partfile.unlink()
+                return CHECKSUM_MISMATCH
+        os.replace(partfile, ofile)
+        return 0
+
+    restart = False
+    with getHostSlot(server), obpgSession.get(urlStr, stream=True, timeout=timeout, headers=headers) as req:
 
-        if req.status_code != 200:
+        # the server doesn't have the requested range: the .part file is stale, start over once this connection is released
+        if req.status_code == 416:
+            restart = True
+
+        elif req.status_code not in (200, 206):
             status = req.status_code
         elif isRequestAuthFailure(req):
             status = 401
@@ -147,14 +376,22 @@ def httpdl(server, request, localpath='.', outputfilename=None, ntries=5,
                 os.umask(0o02)
                 Path.mkdir(localpath, mode=0o2775)
 
-            if not outputfilename:
+            if req.status_code == 200:
                 cd = req.headers.get('Content-Disposition')
                 if cd:
-                    outputfilename = re.findall("filename=(.+)", cd)[0]
-                else:
-                    outputfilename = urlStr.split('/')[-1]
+                    remote_name = re.findall("filename=(.+)", cd)[0].strip('"')
 
-            ofile = localpath / outputfilename
+                if not outputfilename:
+                    outputfilename = LocalFilename(remote_name, uncompress)
+                    ofile = localpath / outputfilename
+                    partfile = ofile.with_name(ofile.name + PART_SUFFIX)
+
+            # gzip and bzip2 files are decompressed on the fly, UNIX compress (.Z) files once downloaded
+            decompressor = None
+            if uncompress and Path(remote_name).suffix in STREAM_DECOMPRESSED:
+                decompressor = StreamDecompressor(Path(remote_name).suffix)
+            elif uncompress and Path(remote_name).suffix == '.Z':
+                ofile = localpath / remote_name
 
             # This is here just in case we didn't get a 304 when we should have...
             download = True
@@ -168,36 +405,99 @@ def httpdl(server, request, localpath='.', outputfilename=None, ntries=5,
                             print("Skipping download of %s" % outputfilename)
 
             if download:
-                total_length = req.headers.get('content-length')
-                length_downloaded = 0
-                total_length = int(total_length)
-                if verbose >0:
+                # a partial response continues the .part file, a full one (the server ignored the range) replaces it
+                if req.status_code == 206:
+                    content_range = re.match(r"bytes (\d+)-\d+/(\d+|\*)", req.headers.get('content-range', ''))
+                    if not content_range or int(content_range.group(1)) != resume_from:
+                        partfile.unlink()
+                        return INCOMPLETE
+                    total_length = None if content_range.group(2) == '*' else int(content_range.group(2))
+                    length_downloaded = resume_from
+                    mode = 'ab'
+                else:
+                    total_length = req.headers.get('content-length')
+                    total_length = None if total_length is None else int(total_length)
+                    length_downloaded = 0
+                    mode = 'wb'
+
+                if verbose >0 and total_length:
                     print("Downloading %s (%8.2f MBs)" % (outputfilename, total_length /1024/1024))
 
-                with open(ofile, 'wb') as fd:
+                # the file is hashed as it arrives - only the part downloaded by a previous attempt has to be read back
+                hasher = None
+                if checksum:
+                    hasher = hashlib.new(checksum[0])
+                    if mode == 'ab':
+                        with open(partfile, 'rb') as fd:
+                            for chunk in iter(lambda: fd.read(chunk_size), b''):
+                                hasher.update(chunk)
+
+                corrupt = None # the decompression error, if the compressed data is corrupt
+                with open(partfile, mode) as fd:
 
                     for chunk in req.iter_content(chunk_size=chunk_size):
                         if chunk: # filter out keep-alive new chunks
+                            bandwidth.Consume(priority, len(chunk))
                             length_downloaded += len(chunk)
+                            if hasher:
+                                hasher.update(chunk)
+                            if decompressor:
+                                try:
+                                    chunk = decompressor.decompress(chunk)
+                                except (zlib.error, OSError) as e:
+                                    corrupt = e
+                                    break
                             fd.write(chunk)
-                            if verbose > 0:
+                            if verbose > 0 and total_length:
                                 percent_done = int(50 * length_downloaded / total_length)
                                 sys.stdout.write("\r[%s%s]" % ('=' * percent_done, ' ' * (50-percent_done)))
                                 sys.stdout.flush()
 
-                if uncompress:
-                    if ofile.suffix in {'.Z', '.gz', '.bz2'}:
-                        if verbose:
-                            print("\nUncompressing {}".format(ofile))
-                        compressStatus = uncompressFile(ofile)
-                        if compressStatus:
-                            status = compressStatus
-                else:
-                    status = 0
+                # the compressed data is corrupt - discard it
+                if corrupt:
+                    print("Warning! Unable to decompress %s: %s" % (remote_name, corrupt))
+                    partfile.unlink()
+                    return INCOMPLETE
+
+                # the connection ended early - keep the .part file, the next attempt will resume it (if it isn't being decompressed)
+                if total_length is not None and length_downloaded != total_length:
+                    if verbose:
+                        print("\nIncomplete download of %s (%d of %d bytes)" % (outputfilename, length_downloaded, total_length))
+                    return INCOMPLETE
+
+                # the file isn't the one listed in CMR - discard it
+                if (expected_size is not None and length_downloaded != expected_size) or \
+                   (hasher and hasher.hexdigest() != checksum[1]):
+                    print("Warning! %s doesn't match its checksum or size" % outputfilename)
+                    partfile.unlink()
+                    return CHECKSUM_MISMATCH
+
+                # the compressed data ended in the middle of a stream
+                if decompressor and not decompressor.complete:
+                    print("Warning! Unable to decompress %s" % remote_name)
+                    partfile.unlink()
+                    return INCOMPLETE
+
+                os.replace(partfile, ofile)
+
+                if uncompress and ofile.suffix == '.Z':
+                    if verbose:
+                        print("\nUncompressing {}".format(ofile))
+                    compressStatus = uncompressFile(ofile)
+                    if compressStatus:
+                        status = compressStatus
+                    elif outputfilename and ofile.stem != outputfilename:
+                        os.replace(ofile.with_suffix(''), localpath / outputfilename)
 
                 if verbose:
                     print("\n...Done")
 
+    if restart:
+        partfile.unlink()
+        return httpdl(server, request, localpath=localpath, outputfilename=outputfilename, ntries=ntries,
+                      uncompress=uncompress, timeout=timeout, verbose=verbose, force_download=force_download,
+                      chunk_size=chunk_size, checksum=checksum, expected_size=expected_size, priority=priority)
+
     return status
 
 def uncompressFile(compressed_file):
@@ -232,7 +532,7 @@ def get_file_time(localFile):
 
     return ftime
 
-def RetrieveURL(request, localpath, appkey):
+def RetrieveURL(request, localpath, appkey, outputfilename=None, checksum=None, expected_size=None, priority=None):
     server = "oceandata.sci.gsfc.nasa.gov"
     parsedRequest = urlparse(request)
     netpath = parsedRequest.path
@@ -251,8 +551,10 @@ def RetrieveURL(request, localpath, appkey):
     if parsedRequest.query:
         netpath = netpath + joiner + parsedRequest.query
 
-    return httpdl(server, netpath, localpath=localpath, uncompress=True, verbose=False, force_download=False)
+    return httpdl(server, netpath, localpath=localpath, outputfilename=outputfilename, uncompress=True, verbose=False, force_download=False,
+                  checksum=checksum, expected_size=expected_size, priority=priority)
 
-# download the file specified by the download URL, and rename it to the specified name
-def DownloadFile(download_url, download_location):
-    return RetrieveURL(download_url, download_location, params.appkey)
\ No newline at end of file
+# download the file specified by the download URL into the specified location, under the specified name (by default, the server's)
+# checksum and expected_size are checked while downloading, if given, and priority is the download's bandwidth class (see httpdl)
+def DownloadFile(download_url, download_location, filename=None, checksum=None, expected_size=None, priority=None):
+    return RetrieveURL(download_url, download_location, params.appkey, filename, checksum, expected_size, priority)
\ No newline at end of file
@@ -15,6 +15,9 @@ import _sqlhandler as sql
 
 
 def UserInput():
+    # what sattelites - all of them if none are given
+    missions = [util.ID_TO_NAME[id.upper()] for id in input(util.mission_prompt)]
+
     try:
         start_date = datetime.strptime(
             input("Please put the start date from which you want the data, in the following format: YYYY-MM-DD.\nYour answer: "),
@@ -34,18 +37,14 @@ def UserInput():
         exit("Program terminated.")
 
 
-    return start_date, end_date, priority
+    return missions, start_date, end_date, priority
 
 def main():
-    start_date, end_date, priority = UserInput()  
+    missions, start_date, end_date, priority = UserInput()  
     
-    all_files = sql.GetExisting("L2_files")
-
-    for file in all_files:
-
-        properties = util.GetFileProperties(file)
-        if properties["date"] >= start_date and properties["date"] <= end_date:
-            sql.UpdatePriority("L2_files",file ,priority)
+    # update all the existing files in the timespan in a single statement
+    updated = sql.UpdatePriorityInRange("L2_files", start_date, end_date, priority, missions, existing=True)
+    print("The priority of", updated, "files has changed to:", priority)
     
 
 
@@ -6,6 +6,9 @@ import _sqlhandler as sql
 
 
 def UserInput():
+    # what sattelites - all of them if none are given
+    missions = [util.ID_TO_NAME[id.upper()] for id in input(util.mission_prompt)]
+
     try:
         start_date = datetime.strptime(
             input("Please put the start date from which you want the data, in the following format: YYYY-MM-DD.\nYour answer: "),
@@ -17,18 +20,16 @@ def UserInput():
         print("An invalid date was entered.")
         exit("Program terminated.")
 
-    return start_date, end_date, 
+    return missions, start_date, end_date
 
 
 def main():
     
-    start_date, end_date = UserInput()  
-    files = sql.GetExisting("L3m_files") 
-    for f in files:
-        properties = util.GetFileProperties(f)
-        if properties["date"] >= start_date and properties["date"] <= end_date:
-            sql.UpdateStatus("L3m_files" ,f ,1)
-            print("The file name's: ", f, "status has changed to: ", sql.GetFileStatus("L3m_files", f))
+    missions, start_date, end_date = UserInput()  
+
+    # update all the existing files in the timespan in a single statement
+    updated = sql.UpdateStatusInRange("L3m_files", start_date, end_date, 1, missions, existing=True)
+    print("The status of", updated, "files has changed to: 1")
 
     
     
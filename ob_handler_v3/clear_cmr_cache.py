@@ -0,0 +1,22 @@
+"""
+CMR Cache Invalidation
+
+Description:
+This is an application for clearing the on-disk cache of CMR search results used by the queuer.
+The cache is normally revalidated against CMR automatically (see cmr_cache_ttl in params.py),
+this is only needed when the cached search results are known to be wrong.
+"""
+
+import _sqlhandler as sql
+
+
+def main():
+    shortname = input("Please type the shortname whose cached search results should be cleared (i.e. MODISA_L2_OC).\nTo clear the entire cache, press [Enter].\nYour answer: ")
+
+    sql.ClearCache(shortname.strip())
+
+    print("Cache cleared.")
+
+
+if __name__ == "__main__":
+    main()
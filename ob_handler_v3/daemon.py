@@ -0,0 +1,114 @@
+"""
+Sattelite Data Handler Daemon
+
+Description:
+This script runs the whole pipeline - queuing, downloading and processing - in a single long-running process.
+The stages share the database connections, the HTTP sessions and the in-memory caches,
+the OCSSW environment is loaded only once, and every downloaded file is handed over to the processing stage right away.
+
+How-to-Use:
+Run this script instead of downloader.py and processor.py. It keeps running until it is interrupted (Ctrl+C).
+To queue up data, put a job file in params.job_dir, for example:
+    {"missions": "atn", "start": "2021-01-01", "end": "2021-12-31", "priority": 3}
+missions are the identifiers used by queuer.py (all of params.default_missions if omitted), and priority is 3 if omitted.
+Write the job file under a name not ending with .json, and rename it once it's complete, so it is never read half-written.
+Jobs are moved to the done/ subfolder once queued up, or to the failed/ subfolder if they couldn't be.
+
+NOTE: queuer.py can still be used while the daemon runs. The files it queues up are picked up within params.daemon_poll_interval.
+"""
+
+# local imports
+import params
+import _util as util
+import _sqlhandler as sql
+import queuer
+import downloader
+import processor
+
+import os
+import json
+import time
+from datetime import datetime
+from threading import Thread, Event
+
+# returns a wait(timeout) function, that waits until the event is set or the timeout passes, and resets it
+def Waiter(event):
+    def wait(timeout):
+        woke = event.wait(timeout)
+        event.clear()
+        return woke
+    return wait
+
+# reads a job file into the arguments of queuer.QueueRequest
+def ReadJob(path):
+    with open(path) as f:
+        job = json.load(f)
+
+    missions = [util.ID_TO_NAME[id.upper()] for id in job.get("missions") or params.default_missions]
+    timespan = queuer.Interval(datetime.strptime(job["start"], "%Y-%m-%d"), datetime.strptime(job["end"], "%Y-%m-%d"))
+    priority = int(job.get("priority", 3))
+    if priority > 5 or priority < 1:
+        raise ValueError("Invalid priority " + str(priority))
+
+    return missions, timespan, priority
+
+# moves a job file into the given subfolder of the job directory
+def ArchiveJob(path, subfolder):
+    folder = params.job_dir + subfolder + '/'
+    os.makedirs(folder, exist_ok=True)
+    os.replace(path, folder + os.path.basename(path))
+
+# queues up the jobs put in the job directory, oldest first, and wakes the downloads up whenever files were queued up
+def RunJobs(files_queued):
+    os.makedirs(params.job_dir, exist_ok=True)
+
+    while True:
+        jobs = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(params.job_dir)
+                      if entry.is_file() and entry.name.endswith(".json"))
+
+        for mtime, path in jobs:
+            print("Queuing up the job", os.path.basename(path) + "...")
+            try:
+                queued = queuer.QueueRequest(*ReadJob(path))
+            except (Exception, SystemExit) as e: # the library exits on some errors, i.e. a CMR error
+                print("The job", os.path.basename(path), "failed:", e)
+                ArchiveJob(path, "failed")
+                continue
+
+            ArchiveJob(path, "done")
+            if queued:
+                files_queued.set()
+
+        time.sleep(params.daemon_poll_interval)
+
+# runs the given stage, and restarts it whenever it stops or dies
+# each stage lets the work it started finish before stopping, so that nothing is done twice after a restart
+def Supervise(name, target, *args):
+    while True:
+        try:
+            target(*args)
+            print("The", name, "stage stopped. Restarting it in", params.daemon_poll_interval, "seconds.")
+        except (Exception, SystemExit) as e: # the library exits on some errors, i.e. a CMR or a database error
+            print("The", name, "stage died:", repr(e) + ". Restarting it in", params.daemon_poll_interval, "seconds.")
+        time.sleep(params.daemon_poll_interval)
+
+def main():
+    # DONT REMOVE THIS
+    processor.LoadEnvVariables()
+
+    print("Daemon started. Waiting for jobs in", params.job_dir)
+
+    files_queued = Event()
+    files_downloaded = Event()
+
+    Thread(target=Supervise, args=("queuing", RunJobs, files_queued), daemon=True).start()
+    Thread(target=Supervise, args=("downloading", downloader.RunDownloads, Waiter(files_queued), lambda filename: files_downloaded.set()), daemon=True).start()
+
+    try:
+        Supervise("processing", processor.RunProcessing, Waiter(files_downloaded), True)
+    except KeyboardInterrupt:
+        sql.ReleaseLeases(processor.WORKER_ID)
+        print("Daemon stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,16 @@ This is a application for deleting L2 files from specified time span chosen by t
 
 from datetime import datetime
 
+import os
+
 import _util as util
 import _sqlhandler as sql
 
 
 def UserInput():
+    # what sattelites - all of them if none are given
+    missions = [util.ID_TO_NAME[id.upper()] for id in input(util.mission_prompt)]
+
     try:
         start_date = datetime.strptime(
             input("Please put the start date from which you want the data, in the following format: YYYY-MM-DD.\nYour answer: "),
@@ -25,19 +30,17 @@ def UserInput():
         print("An invalid date was entered.")
         exit("Program terminated.")
 
-    return start_date, end_date, 
+    return missions, start_date, end_date
 
 def main():
-    start_date, end_date = UserInput()  
+    missions, start_date, end_date = UserInput()  
     
-    l2List = util.GetExistingFilenamesAndPaths(params.path_to_data+"L2/")
-    location_pointer = 0
-    for file in l2List[1]:
-
-        properties = util.GetFileProperties(file)
-        if properties["date"] >= start_date and properties["date"] <= end_date:
-            sql.DeleteSpecificFile(l2List[0][location_pointer], file)
-        location_pointer += 1    
+    # the files in the timespan that are on the disk
+    files = [(f, location + f) for f, status, location in sql.SelectInRange("L2_files", start_date, end_date, missions)
+             if location and os.path.isfile(location + f)]
+
+    sql.DeleteFiles(files)
+    print(len(files), "files were deleted.")
     
 
 
@@ -24,87 +24,216 @@ import params
 import _util as util
 import _sqlhandler as sql
 import _webhandler as web
+import _notifier as notifier
 
 # external imports
 import os
+import json
 import time
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def FolderTooBig():
+# measures the data folder, and corrects the size recorded in the database with the measurement
+def ReconcileDiskUsage():
+    recorded = sql.GetDiskUsage() or 0
     total_size = 0
     for dirpath, dirnames, filenames in os.walk(params.path_to_data): # for every non directory in the path_to_data, add the size of said non directory into total_size
         for f in filenames:
             fp = os.path.join(dirpath, f) # full path of an instance of a non directory in all of the non directories 
-            total_size += os.path.getsize(fp) 
-
-    return total_size > (params.max_folder_size * (2**40)) # returns True if the total size in that folder exceeds the max folder size. ***maybe >= instead of >***
-
-def main():
+            try:
+                total_size += os.path.getsize(fp) 
+            except FileNotFoundError: # deleted while walking
+                continue
 
-    print("Downloader script started.")
+    sql.ReconcileDiskUsage(total_size, recorded)
 
-    ready_files = True
-    while ready_files:
+# runs in the background, correcting any drift in the recorded size every disk_usage_reconcile_interval
+def ReconcileDiskUsagePeriodically(stopped):
+    while not stopped.wait(params.disk_usage_reconcile_interval*3600):
+        ReconcileDiskUsage()
 
-        timeout_counter = 0
+def FolderTooBig():
+    total_size = sql.GetDiskUsage() # the size is kept up to date by the downloader, processor and deleting scripts
 
-        # check if folder size exceeds permitted volume
-        while FolderTooBig(): 
-            print("Data folder size exceeds", params.max_folder_size, "TB. Waiting", params.folder_size_check_interval, "minutes until next check.")
-            print(timeout_counter, "tries left until program times out.")
+    # the very first time, measure the folder
+    if total_size is None:
+        ReconcileDiskUsage()
+        total_size = sql.GetDiskUsage()
 
-            time.sleep(params.folder_size_check_interval*60)
+    return total_size > (params.max_folder_size * (2**40)) # returns True if the total size in that folder exceeds the max folder size. ***maybe >= instead of >***
 
-            timeout_counter += 1
+# the folders that are known to exist, so that each one is only created once
+created_folders = set()
+
+# returns the folder a L2 file belongs in (L2/MISSION_SENSOR/TYPE/), creating it if it does not exist
+def GetL2Folder(filename):
+    properties = util.GetFileProperties(filename) # identifier is Mission + Sensor
+    folder = params.path_to_data + "L2/" + properties.identifier + '/' + properties.type + '/'
+    if folder not in created_folders:
+        os.makedirs(folder, exist_ok=True) # other threads may be creating it at the same time
+        created_folders.add(folder)
+    return folder
+
+# applies the bandwidth settings in params.bandwidth_file, if it changed since they were last applied
+bandwidth_file_time = None
+def LoadBandwidthSettings():
+    global bandwidth_file_time
+
+    if not os.path.isfile(params.bandwidth_file) or os.path.getmtime(params.bandwidth_file) == bandwidth_file_time:
+        return
+    bandwidth_file_time = os.path.getmtime(params.bandwidth_file)
+
+    try:
+        with open(params.bandwidth_file) as f:
+            settings = json.load(f)
+        rate = settings.get("max_bandwidth", params.max_bandwidth)
+        shares = {int(p): float(share) for p, share in settings.get("bandwidth_shares", params.bandwidth_shares).items()}
+        web.bandwidth.Configure(float(rate) * 2**20, shares)
+    except (ValueError, TypeError, AttributeError) as e:
+        print("Invalid bandwidth settings in", params.bandwidth_file + ":", e)
+        return
+
+    print("Bandwidth limited to", rate or "unlimited", "MB/s, with the reserved shares", shares)
+
+# the files that failed for good in this run (i.e. kept failing their checksum, or are missing from the server)
+# they aren't downloaded again until the next run
+failed_files = set()
+
+# id -> times the file's download was interrupted in this run
+interruptions = dict()
+
+# downloads a single L2 file straight into its subfolder, under its ID, and records it in the database
+# file is a (id, download url, checksum, checksum algorithm, size, priority) tuple, as returned by sql.GetReadyForDownload
+# on_downloaded is called with the file's ID once it has been downloaded
+def DownloadAndRecord(file, on_downloaded=notifier.Notify):
+    try:
+        folder = GetL2Folder(file[0])
+        checksum = (file[3], file[2]) if file[2] else None
+
+        # a file that doesn't match its checksum or size is downloaded again right away
+        for attempt in range(params.download_retries + 1):
+            status = web.DownloadFile(file[1], folder, file[0], checksum, file[4], file[5]) # sending the DownloadFile method the download url, the download path and the filename.
+            if status != web.CHECKSUM_MISMATCH:
+                break
+
+        # status=0 means all good, otherwise an exception was encountered.
+        # status=304 means the file already exists on the disk - a previous run downloaded it, but stopped before recording it
+        # status=web.INCOMPLETE means the connection dropped - the download will resume from where it stopped
+        # status=web.CHECKSUM_MISMATCH means the file didn't match the checksum or size listed in CMR
+        if status == 304:
+            print(file[0], "already exists on disk. Recording it as downloaded.")
+        elif status == web.INCOMPLETE:
+            interruptions[file[0]] = interruptions.get(file[0], 0) + 1
+            if interruptions[file[0]] <= params.download_interruptions:
+                print("Downloading", file[0], "was interrupted. It will be resumed later.")
+            else:
+                print("Downloading", file[0], "was interrupted", interruptions[file[0]], "times. It won't be downloaded again in this run.")
+                failed_files.add(file[0])
+            return
+        elif status == web.CHECKSUM_MISMATCH:
+            print("Downloading", file[0], "produced a corrupt file", params.download_retries + 1, "times. It won't be downloaded again in this run.")
+            failed_files.add(file[0])
+            return
+        elif status != 0:
+            print("Downloading", file[0], "failed with status", str(status) + ". It won't be downloaded again in this run.")
+            failed_files.add(file[0])
+            return
+
+        # update database, and let the processor know right away
+        sql.FileDownloaded(file[0], folder)
+        sql.AddDiskUsage(os.path.getsize(folder + file[0]))
+        on_downloaded(file[0])
+
+        print("Downloaded", file[0] + ".")
+
+    except Exception as e:
+        print("Downloading", file[0], "threw an exception:", e, "- it won't be downloaded again in this run.")
+        failed_files.add(file[0])
+
+# returns the queued files that a previous run left partially downloaded, and deletes the leftovers of files that aren't queued anymore
+def GetPartialDownloads():
+    # .part files are named after the file's ID, in its L2/MISSION_SENSOR/TYPE/ folder
+    part_files = dict()
+    if os.path.isdir(params.path_to_data + "L2/"):
+        for mission_folder in os.scandir(params.path_to_data + "L2/"):
+            if mission_folder.is_dir():
+                for type_folder in os.scandir(mission_folder.path):
+                    if type_folder.is_dir():
+                        for entry in os.scandir(type_folder.path):
+                            if entry.name.endswith(web.PART_SUFFIX):
+                                part_files[entry.name[:-len(web.PART_SUFFIX)]] = entry.path
+
+    partial_downloads = sql.GetQueued(part_files.keys()) if part_files else []
+    for id in part_files.keys() - {file[0] for file in partial_downloads}:
+        os.remove(part_files[id])
+
+    return partial_downloads
+
+# downloads the queued up files until there are none left
+# wait_for_files, if given, is called with a timeout whenever there are none, to wait for more files to be queued up instead of stopping
+# on_downloaded is called with the ID of every file downloaded
+def RunDownloads(wait_for_files=None, on_downloaded=notifier.Notify):
+
+    stopped = Event()
+    Thread(target=ReconcileDiskUsagePeriodically, args=(stopped,), daemon=True).start()
+
+    pool = ThreadPoolExecutor(params.download_threads)
+    in_flight = {} # id -> future of the files being downloaded, or waiting for a free thread
+
+    # on an error, let the downloads in progress finish before stopping, so that a restart doesn't download them twice
+    try:
+        # before anything else, resume the downloads a previous run didn't finish
+        for file in GetPartialDownloads():
+            print("Resuming the download of", file[0] + ".")
+            in_flight[file[0]] = pool.submit(DownloadAndRecord, file, on_downloaded)
+
+        while True:
+
+            timeout_counter = 0
+
+            # check if folder size exceeds permitted volume
+            while FolderTooBig(): 
+                print("Data folder size exceeds", params.max_folder_size, "TB. Waiting", params.folder_size_check_interval, "minutes until next check.")
+                print(timeout_counter, "tries left until program times out.")
+
+                time.sleep(params.folder_size_check_interval*60)
+
+                timeout_counter += 1
+
+                if timeout_counter >= params.folder_size_check_timeout: 
+                    print("Downloader script terminated due to the data folder exceeding the permitted size for",
+                          params.folder_size_check_interval*params.folder_size_check_timeout,
+                          "minutes.")
+
+            LoadBandwidthSettings()
+
+            # queue up the next X files, skipping the ones that are already being downloaded, or failed for good
+            ready_files = sql.GetReadyForDownload(params.download_chunk_size + len(in_flight) + len(failed_files)) # getting a list of tuples from the db, based on priority. [0] is the id and [1] is the download url
+            ready_files = [file for file in ready_files if file[0] not in in_flight and file[0] not in failed_files]
+            if not ready_files and not in_flight:
+                if wait_for_files is None:
+                    break
+                wait_for_files(params.daemon_poll_interval)
+                continue
 
-            if timeout_counter >= params.folder_size_check_timeout: 
-                print("Downloader script terminated due to the data folder exceeding the permitted size for",
-                      params.folder_size_check_interval*params.folder_size_check_timeout,
-                      "minutes.")
+            for file in ready_files:
+                in_flight[file[0]] = pool.submit(DownloadAndRecord, file, on_downloaded)
 
-        # download the next X files
-        ready_files = sql.GetReadyForDownload(params.download_chunk_size) # getting a list of tuples from the db, based on priority. [0] is the id and [1] is the download url
-        for file in ready_files: 
+            # look for more files once a thread is about to be free, so that the threads never run dry
+            while in_flight:
+                wait(in_flight.values(), return_when=FIRST_COMPLETED)
+                in_flight = {id: future for id, future in in_flight.items() if not future.done()}
+                if len(in_flight) <= params.download_threads:
+                    break
+    finally:
+        pool.shutdown(cancel_futures=True)
+        stopped.set()
 
-            # download the file into the data folder
-            print("Downloading", file[0] + "...", end=' ', flush=True)
-            status = web.DownloadFile(file[1], params.path_to_data) # sending the DownloadFile method, the download url and also giving it a download path.
+def main():
 
-            # status=0 means all good, otherwise an exception was encountered.
-            # status=304 means the file already exists on the disk - this should never happen
-            if status == 304:
-                print("Already exists on disk.")
-                continue
-            elif status != 0:
-                print("Failed. Skipping to next file.")
-                continue
+    print("Downloader script started.")
 
-            # if all good
-            print("Done.")
-
-            # rename and move the file into an appropriate subfolder
-            
-            # get file properties
-            properties = util.GetFileProperties(file[0]) # getting the properties of a specific file according to its ID. identifier is Mission + Sensor
-        
-            # determine the appropriate folder (MISSION_SENSOR)
-            subfolder = params.path_to_data + "L2/" + properties["identifier"] + '/' # giving subfolder a signature of a path. this path may exist or not
-            
-            # if the folder does not exist, create it
-            if not os.path.isdir(subfolder): # if said path doesnt exist, we will create it and notify the user
-                os.mkdir(subfolder)
-                print(subfolder, "created")
-                
-            type_subfolder = subfolder + properties["type"] + '/' # *** need to ask lun what is "type" (components[3]) ***
-            
-            if not os.path.isdir(type_subfolder): # if said subfolder doesnt exist, we will create it and notify the user
-                os.mkdir(type_subfolder)
-                print(type_subfolder, "created")
-
-            # move the file
-            os.rename(params.path_to_data + file[1].split('/')[-1], type_subfolder + file[0]) # *** need to ask lun about the logic in this line ***
-
-            # update database
-            sql.FileDownloaded(file[0], type_subfolder)
+    RunDownloads()
 
     print("Downloader script terminated due to no files being queued up for downloading.")
 
@@ -1,19 +1,52 @@
 # database parameters
 path_to_data = "/home/oyankis/original_code/data/"
 db_filename = "file_management.db"
+db_journal_mode = "WAL" # lets readers and a writer work concurrently. doesn't work on network filesystems - use "DELETE" when processors on several machines share the database
+db_busy_timeout = 60 # seconds - how long to wait for a lock before failing
+db_cache_size = 64 # MB per connection
 
 # queuer parameters
 default_missions = "atjns"
+cmr_threads = 8 # concurrent requests to the CMR search API
+cmr_timeout = 60 # seconds
+cmr_cache_filename = "cmr_cache.db" # CMR search results are cached in this database, next to the File Management Database
+cmr_cache_ttl = 24*7 # hours - older search results are revalidated against CMR before being used
 
 # downloader parameters
 max_folder_size = 10 # TB
 folder_size_check_interval = 120 # minutes
 folder_size_check_timeout  = 12  # tries
+disk_usage_reconcile_interval = 24 # hours - how often the recorded folder size is corrected by measuring the folder
 download_chunk_size = 100 # files
+download_threads = 8 # files downloaded concurrently
+max_connections_per_host = 8 # concurrent connections to a single server
+download_retries = 2 # times a file that doesn't match its checksum is downloaded again right away
+download_interruptions = 10 # times a download may be interrupted and resumed in a run, before it's left for the next run
+max_bandwidth = 0 # MB/s for all downloads together, 0 = unlimited
+bandwidth_shares = {1: 0.7} # priority -> minimal share of max_bandwidth while downloading files of that priority
+bandwidth_file = path_to_data + "bandwidth.json" # overrides the two above while the downloader runs, i.e. {"max_bandwidth": 50, "bandwidth_shares": {"1": 0.7}}
 appkey = "6d5b459daa8cfab9462d3e893ee09e0e052cfe92" # appkey - needed to download files
 
 # processor parameters
 data_availability_check_interval = 60 # minutes
 data_availability_check_timeout  = 12 # tries
-resolution = "1km"
-threads = 10
+L3m_outputs = { # type -> (product, resolution) of every L3m file mapped from a day's L3b. the first one is the target L2 files are queued for
+    "OC": [("chlor_a", "1km")],
+    "SST": [("sst", "1km")]
+    }
+binning_threads = 0 # concurrent l2bin runs, 0 = one per CPU core
+mapping_threads = 0 # concurrently mapped tasks, each running an l3mapgen per L3m output, 0 = one per CPU core
+scratch_dir = "/tmp/ob_handler/" # L3b files and l2bin input lists - preferably on a local SSD or tmpfs
+ocssw_env_cache = scratch_dir + "ocssw_env.json" # the variables set by $OCSSWROOT/OCSSW_bash.env, resolved again when it or the environment they build on change
+reserved_cores = 1 # CPU cores left for the downloader and the system
+processing_memory_fraction = 0.8 # fraction of the memory available at startup that tasks may use
+task_memory_base = 500 # MB - estimated memory use of any task
+task_memory_per_granule = 50 # MB - estimated extra memory use for every L2 file in a task
+task_memory_per_input_mb = 1 # MB - estimated extra memory use for every MB of L2 files in a task
+notification_socket_dir = path_to_data + "sockets/" # the downloader wakes the processors up through their sockets in this folder
+lease_duration = 30 # minutes - how long a batch stays claimed by a processor that stopped sending heartbeats
+heartbeat_interval = 1 # minutes
+
+# daemon parameters
+job_dir = path_to_data + "jobs/" # the daemon queues up the jobs put here, see daemon.py
+daemon_poll_interval = 60 # seconds - how often the daemon looks for new jobs, and for files queued up by queuer.py
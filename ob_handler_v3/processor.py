@@ -10,197 +10,391 @@ This script looks for L2 files that are ready to get processed, and processes th
 How-to-Use:
 This script automatically finds unprocessed L2 files, processes them to L3m, and deletes the L2 and L3b raw data.
 It is multithreaded, and runs multiple workers that do the actual work.
-If no L2 files are available, the script will wait until they appear.
+Every batch is first binned (l2bin) into a scratch directory by the binning workers, then mapped (l3mapgen) by the mapping workers,
+so the two stages overlap. Each stage has its own queue and number of workers, by default one per CPU core,
+and a task is only started once its estimated memory use fits in the memory left.
+Every L3b is mapped into all the L3m outputs of its type (params.L3m_outputs) at once, and each of them is recorded in the database.
+If no L2 files are available, the script will wait until they appear - the downloader notifies it as soon as a file is downloaded.
 If a certain time passes without any L2 files available to be processed, the script terminates.
 
-NOTE: Only one instance of this script may be running at a time.
+Several instances of this script may run at once, even on different machines sharing the data folder and database:
+every batch is claimed in the database with a lease, which its processor renews with heartbeats while processing it.
+The leases of a processor that crashed expire after params.lease_duration, and its batches are then claimed by others.
+NOTE: when running on several machines, the database must not use WAL (see params.db_journal_mode).
 """
 
 # local imports
 import _util as util
 import _sqlhandler as sql
+import _notifier as notifier
 import params
 
 import subprocess as sp
 from queue import Queue
-from threading import Thread
+from threading import Thread, Lock, Event
 from datetime import datetime
 import os
 import time
 import json
+import hashlib
+import socket
+from types import MappingProxyType
+
+# returns the memory available to new processes, in bytes
+def AvailableMemory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024 # the value is in kB
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+class ResourceBudget:
+    """
+    keeps track of the memory that the tasks in progress are estimated to use,
+    so that a task is only started when it fits into what the machine has left
+    a task holds its share from the moment it is admitted until it has been mapped
+    """
+    def __init__(self, max_tasks):
+        self.lock = Lock()
+        self.max_tasks = max_tasks
+        self.memory = AvailableMemory() * params.processing_memory_fraction
+        self.tasks = 0
+        self.used_memory = 0
+        self.released = Event() # set whenever a task frees its resources
+
+    # estimates the memory, in bytes, that processing the given L2 files (full paths) will take
+    # the task's L3m outputs are mapped at once, each l3mapgen run taking about as much as a single run on the task
+    def Cost(self, L2_file_list):
+        input_size = sum(os.path.getsize(filename) for filename in L2_file_list if os.path.isfile(filename))
+        outputs = len(params.L3m_outputs[util.GetFileProperties(L2_file_list[0].split('/')[-1]).type])
+        return ((params.task_memory_base + params.task_memory_per_granule * len(L2_file_list)) * 2**20
+                + params.task_memory_per_input_mb * input_size) * outputs
+
+    # reserves the resources of a task with the given cost. returns False if they are not available right now
+    # a task is always admitted when nothing else runs, so that tasks bigger than the whole budget still get processed
+    def Admit(self, cost):
+        with self.lock:
+            if self.tasks:
+                if self.tasks >= self.max_tasks or self.used_memory + cost > self.memory or cost > AvailableMemory():
+                    return False
+            self.tasks += 1
+            self.used_memory += cost
+            return True
+
+    # frees the resources of a task that finished
+    def Release(self, cost):
+        with self.lock:
+            self.tasks -= 1
+            self.used_memory -= cost
+        self.released.set()
+
+class Task:
+    """
+    a batch of L2 files with the same L3m target, on its way through the binning and mapping stages
+    """
+    def __init__(self, target, L2_file_list, cost):
+        self.target = target
+        self.L2_file_list = L2_file_list # full paths
+        self.cost = cost
+        self.props = util.GetFileProperties(L2_file_list[0].split('/')[-1])
+        self.L3b_fullpath = params.scratch_dir + util.ProduceL3bFilename(L2_file_list[0].split('/')[-1])
+
+# the environment l2bin and l3mapgen run in, set by LoadEnvVariables
+ocssw_env = MappingProxyType(os.environ.copy())
+
+# identifies this processor's leases in the database
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
 
 class Worker(Thread): # a class of a worker, a sinle thread in our glorious multi threading processing!
-    def __init__(self, queue, id):
-        Thread.__init__(self)
-        self.queue = queue # a single shared queue that all the workers get
+    stage = None # the name of the worker's stage, set by its subclasses
+
+    def __init__(self, queue, id, in_flight, budget):
+        Thread.__init__(self, daemon=True) # idle workers don't keep the script running
+        self.queue = queue # the queue of the worker's stage, shared by all the workers of that stage
         self.id = id
-        self.target = None
+        self.in_flight = in_flight # the targets that are queued up or being processed, shared by all workers
+        self.budget = budget # the resources reserved by the tasks, shared by all workers
 
     def run(self): # a method of a worker, the worker will be in an infinite loop. constantly search for a task to do.
         while True:
-            try:
-                task = self.queue.get(block=True) # the worker will get a task from the queue. if there are not tasks to get, the worker will wait not in loop until theres task
-                print("Worker", self.id, "given a task.")
-                self.target = util.ProduceL3mFilename(task[0]) # the target is the name of the L3m 
-                self.Execute(task) # executing said task
-            except Exception as e:
-                print(datetime.now(), "Worker", self.id, "threw an exception:", e) 
-            finally:
-                self.target = None
+            task = self.queue.get(block=True) # the worker will get a task from the queue. if there are not tasks to get, the worker will wait not in loop until theres task
+            if task is None: # the processing stopped
                 self.queue.task_done()
+                return
+            try:
+                print(self.stage, "worker", self.id, "given a task.")
+                finished = self.Execute(task) # executing said task
+            except (Exception, SystemExit) as e: # the database handler exits on errors
+                print(datetime.now(), self.stage, "worker", self.id, "threw an exception:", e)
+                finished = True
+            if finished:
+                self.Finish(task)
+            self.queue.task_done()
+
+    # stop tracking a task that went through all its stages, or failed in one of them
+    def Finish(self, task):
+        if os.path.isfile(task.L3b_fullpath):
+            os.remove(task.L3b_fullpath)
+        self.budget.Release(task.cost)
+        self.in_flight.discard(task.target)
+        sql.ReleaseLease(WORKER_ID, task.target)
+
+class BinningWorker(Worker):
+    stage = "Binning"
+
+    def __init__(self, queue, id, in_flight, budget, mapping_queue):
+        Worker.__init__(self, queue, id, in_flight, budget)
+        self.mapping_queue = mapping_queue # binned tasks are handed over to the mapping workers through this queue
+
+    # bins the task's L2 files into its L3b file in the scratch directory, and hands it over to the mapping stage
+    # returns True if the task is finished, i.e. binning failed
+    def Execute(self, task):
+        props = task.props
 
-    def Execute(self, L2_file_list): # the method that processes the batch of L2s into L3b and then finally L3M.
-
-        # turn L2_file_list into list
-        #L2_file_list = L2_file_list.split(',')
-
-        # get general properties about this batch
-        props = util.GetFileProperties(L2_file_list[0])
-
-        # add full path to L2 filenames
-        L2_location = sql.GetFileLocation("L2_files", L2_file_list[0]) # the reason we took the first L2 file in the list is because all of them are in the same location.
-        L2_file_list = [L2_location+filename for filename in L2_file_list] # we now add to each member of the list, his path so he can be acessed and processed. 
-        
-        # l2bin !!
-
-        # if the L3b directory does not exist, create it
-        L3b_dir = params.path_to_data + "L3b/" # (ofek) i added this so there wont be any unnecessary extra letters D:
-        if not os.path.isdir(L3b_dir): # this is where all the L3b files will be.
-            os.mkdir(L3b_dir)
-            
-        # produce L3b filename
-        L3b_fullpath = L3b_dir + util.ProduceL3bFilename(L2_file_list[0].split('/')[-1]) # this is a specific path of an instance of L3b
-        
         # prepare input
-        input_file = f"/tmp/{props['identifier']}_{props['type']}_l2bin_temp_{props['date'].strftime('%Y%d%m')}.txt" # *** need to ask lun again about the txt logic ***
-        f = open(input_file, 'w')
-        for filename in L2_file_list: # a for that writes in a txt file the name and the path of each l2 in a new line
-            f.write(filename+"\n")
-        f.close()
+        input_file = params.scratch_dir + f"{props.identifier}_{props.type}_l2bin_temp_{props.day}.txt"
+        with open(input_file, 'w') as f:
+            for filename in task.L2_file_list: # writes the path of each l2 in a new line
+                f.write(filename+"\n")
 
         args = [    # a list of all the vars needed for the sp.run() method.
             "l2bin", # method name
             f"ifile={input_file}", # location of where the txt file is
-            f"ofile={L3b_fullpath}", # destination path
-            f"l3bprod={util.TYPE_TO_PRODUCT[props['type']]}",
-            "resolution=1"
+            f"ofile={task.L3b_fullpath}", # destination path
+            f"l3bprod={','.join(util.BinnedProducts(props.type))}",
+            f"resolution={util.BINNING_RESOLUTION[util.BinnedResolution(props.type)]}"
             ]
 
-        print(datetime.now(), "Worker", self.id, "started binning", L3b_fullpath.split('/')[-1])
-        sp.run(args, env=os.environ.copy(), stdout=sp.DEVNULL) 
+        print(datetime.now(), "Binning worker", self.id, "started binning", task.L3b_fullpath.split('/')[-1])
+        sp.run(args, env=ocssw_env, stdout=sp.DEVNULL)
+        os.remove(input_file)
 
-        # l3mapgen
+        if not os.path.isfile(task.L3b_fullpath):
+            print(datetime.now(), "Binning worker", self.id, "didn't produce any output.")
+            return True
 
-        # if the L3m directory does not exist, create it
-        if not os.path.isdir(params.path_to_data + "L3m/"):
-            os.mkdir(params.path_to_data + "L3m/")
+        self.mapping_queue.put(task)
+        return False
 
-        # if the mission directory does not exist, create it
-        mission_subdirectory = params.path_to_data + "L3m/" + props["identifier"] + '/'
-        if not os.path.isdir(mission_subdirectory):
-            os.mkdir(mission_subdirectory)
-        # if the type subdirectory does not exist, create it
-        type_subdirectory = mission_subdirectory + props["type"] + '/'
-        if not os.path.isdir(type_subdirectory):
-            os.mkdir(type_subdirectory)
+class MappingWorker(Worker):
+    stage = "Mapping"
 
-        L3m_fullpath = type_subdirectory + util.ProduceL3mFilename(L2_file_list[0].split('/')[-1])
-        
-        args = [
-            "l3mapgen",
-            f"ifile={L3b_fullpath}",
-            f"ofile={L3m_fullpath}",
-            f"product={util.TYPE_TO_PRODUCT[props['type']]}",
-            "resolution=1km",
-            "interp=area"
-            ]
-        
-        print(datetime.now(), "Worker", self.id, "started mapping", L3m_fullpath.split('/')[-1])
-        sp.run(args, env=os.environ.copy(), stdout=sp.DEVNULL) # 
+    # maps the task's L3b file into all its L3m outputs at once, and deletes the raw data (L2 & L3b) if its target was produced
+    # returns True, as mapping is the last stage
+    def Execute(self, task):
+        props = task.props
+
+        # create the L3m/<mission>/<type>/ directory if needed
+        type_subdirectory = params.path_to_data + "L3m/" + props.identifier + '/' + props.type + '/'
+        os.makedirs(type_subdirectory, exist_ok=True)
+
+        L2_filename = task.L2_file_list[0].split('/')[-1]
+        processes = {}
+        for product, resolution in params.L3m_outputs[props.type]:
+            L3m_fullpath = type_subdirectory + util.ProduceL3mFilename(L2_filename, product, resolution)
+
+            args = [
+                "l3mapgen",
+                f"ifile={task.L3b_fullpath}",
+                f"ofile={L3m_fullpath}",
+                f"product={product}",
+                f"resolution={resolution}",
+                "interp=area"
+                ]
+
+            print(datetime.now(), "Mapping worker", self.id, "started mapping", L3m_fullpath.split('/')[-1])
+            processes[L3m_fullpath] = sp.Popen(args, env=ocssw_env, stdout=sp.DEVNULL)
+
+        for process in processes.values():
+            process.wait()
+
+        produced = [L3m_fullpath for L3m_fullpath in processes if os.path.isfile(L3m_fullpath)]
+        for L3m_fullpath in processes:
+            if L3m_fullpath not in produced:
+                print(datetime.now(), "Mapping worker", self.id, "didn't produce", L3m_fullpath.split('/')[-1])
 
         # if processing successful delete raw data (L2 & L3b)
-        if os.path.isfile(L3m_fullpath):
+        if type_subdirectory + task.target in produced:
 
-            print(datetime.now(), "Worker", self.id, "finished mapping", L3m_fullpath.split('/')[-1], "now deleting input files.")
+            print(datetime.now(), "Mapping worker", self.id, "finished mapping", task.target, "now deleting input files.")
 
-            # delete files
-            for filename in L2_file_list:
+            # delete files, keeping track of how the data folder's size changed
+            size_delta = sum(os.path.getsize(L3m_fullpath) for L3m_fullpath in produced)
+            for filename in task.L2_file_list:
+                size_delta -= os.path.getsize(filename)
                 os.remove(filename)
-            os.remove(L3b_fullpath)
             
-            # update DB entries' statuses to 2 (processed)
-            for filename in L2_file_list:
-                sql.UpdateStatus("L2_files", filename.split('/')[-1], 2)
-
-            # update L3m DB entry
-            sql.FileProduced(L3m_fullpath.split('/')[-1], type_subdirectory)
+            # update DB entries' statuses to 2 (processed) and the L3m DB entries, in a single transaction
+            sql.FilesProcessed([filename.split('/')[-1] for filename in task.L2_file_list],
+                               [L3m_fullpath.split('/')[-1] for L3m_fullpath in produced], type_subdirectory, size_delta)
 
-            print(datetime.now(), "Worker", self.id, "finished task successfully.")
+            print(datetime.now(), "Mapping worker", self.id, "finished task successfully.")
         else:
             # alert user
-            print(datetime.now(), "Worker", self.id, "didn't produce any output.")
+            print(datetime.now(), "Mapping worker", self.id, "didn't produce any output.")
 
-def LoadEnvVariables():
-    source = f"source {os.environ['OCSSWROOT']}/OCSSW_bash.env"
-    dump = '/usr/bin/python3 -c "import os, json;print(json.dumps(dict(os.environ)))"'
-    pipe = sp.Popen(['/bin/bash', '-c', '%s && %s' %(source,dump)], stdout=sp.PIPE)
-    env = json.loads(pipe.stdout.read())
-    os.environ = env
-
-# returns a list of L2 files that have the same target and are all downloaded, but not processed yet
-def GetTask(forbidden_list):
-    for i in range(params.data_availability_check_timeout):
-        # creating a list that contains small lists that in each list, all the L2s have the same L3 "target"
-        initial_list = sql.GetFilesReadyForProcessing() # initial list that contains all the tuples of L2s in the database
-        father_list = [] # the list that contains all the lists
-        inner_list = [] # the list inside fatherlist that all the tuples have the same L3
-        target_check = initial_list[0][2] # the first L3 "target" before the for
-        for list_info in initial_list: # this for sorts all the lists into same L3 and stores these lists into the fatherList
-            if target_check == list_info[2]: # if the tuple has the same L3 as the target check 
-                inner_list.append(list_info)
-            else:
-                target_check = list_info[2]
-                father_list.append(inner_list[:]) # inserting the little list into the father list we used [:] so it wont be a reference but the obj itself!
-                inner_list = [] # initialising the litte list
-
-        for inner_list in father_list: # checking for the first inner list that all of the L2s inside are downloaded.
-            if len(inner_list) == 0:
-                continue
-            if util.ProduceL3mFilename(inner_list[0][0]) in forbidden_list:
-                continue
-            checker = True
-            for inner_list_info in inner_list:
-                if inner_list_info[1] != 1: # [1] is the file status. 0 not downloaded 1 downloaded 2 processed
-                    checker = False
-            if checker:  # if checker is true, it means all the L2 in the list are downloaded and its ready to get processed.
-                return [item[0] for item in inner_list] # returning a list of all the relevant L2 files.
-        print ("No list was found suited for processing... waiting 60 minutes.")
-        time.sleep(params.data_availability_check_interval*60)
-        print (params.data_availability_check_timeout - i - 1, "tries left.")
-
-    print ("No batch of L2s with the same L3 target were all ready to be processed.")
-    exit("program terminated")
+        return True
 
-def main():
-    # DONT REMOVE THIS
-    LoadEnvVariables()
+# variables bash sets by itself, rather than the env file
+BASH_VARIABLES = {"SHLVL", "_", "PWD", "OLDPWD"}
+
+# identifies the values the given variables have in this process, as sourcing the env file may build on them (i.e. PATH)
+def InheritedValuesHash(names):
+    inherited = {name: os.environ.get(name) for name in sorted(names)}
+    return hashlib.sha256(json.dumps(inherited).encode()).hexdigest()
+
+# returns the environment variables that sourcing the given env file sets or changes
+# they are cached in params.ocssw_env_cache, and the file is only sourced again when its path or modification time change,
+# or when the variables it sets had other values in the environment it was sourced from
+def GetOCSSWVariables(env_file):
+    key = {"env_file": env_file, "mtime": os.path.getmtime(env_file)}
 
-    tasks = Queue()
+    try:
+        with open(params.ocssw_env_cache) as f:
+            cache = json.load(f)
+        if cache["key"] == key and cache["inherited"] == InheritedValuesHash(cache["variables"]):
+            return cache["variables"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    print("Loading the OCSSW environment from", env_file + "...")
+    output = sp.run(['/bin/bash', '-c', 'source "$0" && env -0', env_file], stdout=sp.PIPE, check=True).stdout
+    env = dict(item.split('=', 1) for item in output.decode().split('\0') if '=' in item)
+    variables = {name: value for name, value in env.items() if os.environ.get(name) != value and name not in BASH_VARIABLES}
+
+    # write the cache under a temporary name first, so that it's never read half-written
+    os.makedirs(os.path.dirname(params.ocssw_env_cache), exist_ok=True)
+    with open(params.ocssw_env_cache + ".tmp", 'w') as f:
+        json.dump({"key": key, "inherited": InheritedValuesHash(variables), "variables": variables}, f)
+    os.replace(params.ocssw_env_cache + ".tmp", params.ocssw_env_cache)
+
+    return variables
+
+def LoadEnvVariables():
+    global ocssw_env
+    os.environ.update(GetOCSSWVariables(f"{os.environ['OCSSWROOT']}/OCSSW_bash.env"))
+    ocssw_env = MappingProxyType(os.environ.copy()) # built once, and shared by all l2bin and l3mapgen runs
+
+# keeps this processor's leases from expiring while it runs
+def SendHeartbeats(stopped):
+    while not stopped.wait(params.heartbeat_interval*60):
+        sql.RenewLeases(WORKER_ID)
+
+# claims up to <limit> (target, L2 files) pairs, where all the L2 files have the same target and are all downloaded, but not processed yet
+# while there are none, waits for new downloads with wait_for_files(timeout), checking again at least every data_availability_check_interval
+# returns an empty list if there are still none after data_availability_check_timeout tries, unless forever is set
+def GetTasks(limit, wait_for_files, forever=False):
+    deadline = time.time() + params.data_availability_check_timeout*params.data_availability_check_interval*60
+    while True:
+        tasks = sql.ClaimReadyBatches(WORKER_ID, limit)
+        if tasks:
+            return tasks
+
+        remaining = deadline - time.time()
+        if remaining <= 0 and not forever:
+            return []
+
+        print ("No list was found suited for processing... waiting for new downloads.")
+        timeout = params.data_availability_check_interval*60
+        wait_for_files(timeout if forever else min(remaining, timeout))
+
+# processes the downloaded L2 files until none are left, and none are downloaded within the data availability timeout
+# wait_for_files(timeout) waits until more L2 files may have been downloaded, or the timeout passes
+# if forever is set, keeps waiting for more L2 files instead of stopping
+# the OCSSW environment must be loaded beforehand (see LoadEnvVariables)
+def RunProcessing(wait_for_files, forever=False):
+    stopped = Event()
+    Thread(target=SendHeartbeats, args=(stopped,), daemon=True).start()
+
+    os.makedirs(params.scratch_dir, exist_ok=True)
+
+    cores = max(1, (os.cpu_count() or 1) - params.reserved_cores)
+    binning_threads = params.binning_threads or cores
+    mapping_threads = params.mapping_threads or cores
+
+    # a task can be waiting in each stage's queue while the workers of both stages are busy
+    budget = ResourceBudget(2 * (binning_threads + mapping_threads))
+    print("Running", binning_threads, "binning and", mapping_threads, "mapping workers, using up to",
+          round(budget.memory / 2**30, 1), "GB of memory.")
+
+    binning_queue = Queue()
+    mapping_queue = Queue()
+    in_flight = set()
     workers = []
-    for i in range(params.threads):
-        worker = Worker(tasks, i)
+    for i in range(binning_threads):
+        worker = BinningWorker(binning_queue, i, in_flight, budget, mapping_queue)
+        worker.start()
+        workers.append(worker)
+    for i in range(mapping_threads):
+        worker = MappingWorker(mapping_queue, i, in_flight, budget)
         worker.start()
         workers.append(worker)
 
-    while sql.ThereAreUnprocessedFiles():
+    # on an error, let the admitted tasks finish before stopping, so that a restart doesn't process them twice
+    failure = None
+    budget_full = False
+    try:
+        while forever or sql.ThereAreUnprocessedFiles():
         
-        time.sleep(1)
-        forbidden_list = [worker.target for worker in workers]
-        task = GetTask(forbidden_list)
+            time.sleep(1)
+
+            # only look for more tasks once a worker is about to be free, and fill the queue in one go
+            free_workers = budget.max_tasks - len(in_flight)
+            if free_workers <= 0:
+                continue
+
+            # once a task didn't fit, don't claim any more until a task frees its resources
+            if budget_full and not budget.released.is_set():
+                continue
+            budget.released.clear()
+
+            # start tasks in order of priority, as long as they fit in the resources left, leaving the rest to be claimed again
+            tasks = GetTasks(free_workers, wait_for_files, forever)
+            if not tasks:
+                print ("No batch of L2s with the same L3 target were all ready to be processed.")
+                break
+
+            admitting = True
+            for target, task in tasks:
+                if admitting:
+                    L2_location = sql.GetFileLocation("L2_files", task[0])
+                    L2_file_list = [L2_location + filename for filename in task]
+                    cost = budget.Cost(L2_file_list)
+                    admitting = budget.Admit(cost)
+                    budget_full = not admitting
+                if not admitting:
+                    sql.ReleaseLease(WORKER_ID, target)
+                    continue
+                in_flight.add(target)
+                binning_queue.put(Task(target, L2_file_list, cost))
+    except (Exception, SystemExit) as e: # the database handler exits on errors
+        failure = e
+
+    # every binned task has been handed over to the mapping queue once the binning queue is done
+    binning_queue.join()
+    mapping_queue.join()
+    sql.ReleaseLeases(WORKER_ID)
+
+    # stop the workers and the heartbeats
+    for worker in workers:
+        worker.queue.put(None)
+    stopped.set()
+
+    if failure:
+        raise failure
+
+def main():
+    # DONT REMOVE THIS
+    LoadEnvVariables()
 
-        tasks.put(task)
+    listener = notifier.OpenListener()
+    RunProcessing(lambda timeout: notifier.WaitForNotification(listener, timeout))
+    notifier.CloseListener(listener)
 
-    tasks.join()
+    print("Processor script terminated.")
 
 if __name__ == "__main__":
     main()
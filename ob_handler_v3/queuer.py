@@ -22,6 +22,7 @@ NOTE 2: This script can be run during downloading/processing of data, to add mor
 """
 
 from datetime import datetime, timedelta
+import re
 
 import params
 import _util as util
@@ -41,7 +42,7 @@ class Interval:
         elif date == self.start:
             return [Interval(self.start + timedelta(1), self.end)]
         elif date == self.end:
-            return [Interval(self.start, self.end + timedelta(1))]
+            return [Interval(self.start, self.end - timedelta(1))]
         else:
             return [Interval(self.start, date-timedelta(1)), Interval(date+timedelta(1), self.end)]
 
@@ -55,6 +56,21 @@ class Interval:
     def copy(self):
         return Interval(self.start, self.end)
 
+    # the number of days in the interval
+    def __len__(self):
+        return (self.end - self.start).days + 1
+
+    # the sub-intervals of this interval that are not covered by the given dates
+    # coverage is kept as a bitmap with a byte per day, and the uncovered runs are found with a single regex scan
+    def uncovered(self, dates):
+        coverage = bytearray(len(self))
+        for date in dates:
+            if self.start <= date <= self.end:
+                coverage[(date - self.start).days] = 1
+
+        return [Interval(self.start + timedelta(run.start()), self.start + timedelta(run.end() - 1))
+                for run in re.finditer(rb"\x00+", coverage)]
+
 # converts a YYYYDDDHHMMSS date format into a YYYYMMDDTHHMMSS time format
 def GenerateTimestamp(ts):
     return datetime.strptime(ts, "%Y%j%H%M%S").strftime("%Y%m%dT%H%M%S")
@@ -119,94 +135,90 @@ def GetUserInput():
 
     return missions, timespan, priority
 
-def main():
-
-    missions, timespan, priority = GetUserInput()
+# asks the user whether to queue up the files found
+def ConfirmQueuing(count):
+    return input("Do you wanna queue " + str(count) + " files to be downloaded? [Y/n] ").lower() == 'y'
 
-    # check database for existing L3m data
-    L3m_files = [util.GetFileProperties(file) for file in sql.GetExisting("L3m_files")]
+# looks up the L2 files of the given missions and timespan that don't exist in L3m format yet, and queues them up for downloading
+# confirm, if given, is called with the number of files found, and they are only queued up if it returns True
+# returns the number of files queued up, or None if they weren't confirmed
+def QueueRequest(missions, timespan, priority, confirm=None):
 
-    # bin data into missions
-    dates_by_mission = {mission: [] for mission in missions}
-    for file in L3m_files:
-        if file["identifier"] in missions:
-            # check if there's an overlap
-            if file["date"] >= timespan.start and file["date"] <= timespan.end:
-                dates_by_mission[file["identifier"]].append(file["date"])
-
-    # fix overlap
+    # exclude the dates that already exist in L3m format, separately for every mission and type
     mission_to_requests = {mission:[] for mission in missions}
-    for mission,dates in dates_by_mission.items():
-        dates.sort()
-        intervals = [timespan.copy()]
-        for date in dates:
-            i = intervals[-1]
-            del intervals[-1]
-            intervals += i.split(date)
-
-        if len(intervals) == 0:
-            print("For the mission", mission,
-                  "no files will be downloaded, as all data in the provided timespan already exists in L3m format.")
-        elif not intervals[0] == timespan:
-            print("For the mission", mission,
-                  """some data in the provided timespan already exists in L3m format. These dates have been excluded.
+    for mission in missions:
+        for shortname in util.MISSION_TO_SHORTNAMES[mission]:
+            data_type = shortname.split('_')[-1]
+            intervals = timespan.uncovered(sql.GetCoveredDates(mission, data_type, timespan.start, timespan.end))
+
+            if len(intervals) == 0:
+                print("For the mission", mission, data_type,
+                      "no files will be downloaded, as all data in the provided timespan already exists in L3m format.")
+            elif not intervals[0] == timespan:
+                print("For the mission", mission, data_type,
+                      """some data in the provided timespan already exists in L3m format. These dates have been excluded.
 Because of that, instead of following the entire timespan, the following timespans will be downloaded:""")
-            for i in intervals:
-                print(i.start.strftime("%Y-%m-%d"), "to", i.end.strftime("%Y-%m-%d"))
+                for i in intervals:
+                    print(i.start.strftime("%Y-%m-%d"), "to", i.end.strftime("%Y-%m-%d"))
 
-        for i in intervals:
-            for shortname in util.MISSION_TO_SHORTNAMES[mission]:
+            for i in intervals:
                 mission_to_requests[mission].append((shortname, str(i)))
 
-    # check number of expected files to be downloaded
+    # search for all the files at once, then check number of expected files to be downloaded
+    print("Searching for files to be downloaded...")
+    search_results = web.SearchGranules(request for requests in mission_to_requests.values() for request in requests)
     s = 0
-    print("Counting number of files to be downloaded...")
+    granules = []
     for mission, requests in mission_to_requests.items():
-        print("Number of", mission, "files to be downloaded:", end=' ')
-        n = sum([web.GetNumberOfFiles(*request) for request in requests])
-        s += n
-        print(n)
+        mission_granules = [granule for request in requests for granule in search_results[request]]
+        print("Number of", mission, "files to be downloaded:", len(mission_granules))
+        s += len(mission_granules)
+        granules += mission_granules
 
     # final green light
-    if input("Do you wanna queue " + str(s) + " files to be downloaded? [Y/n] ").lower() != 'y':
-        exit("Program terminated")
-
-    # fetch filenames
-    filenames = []
-    for mission, requests in mission_to_requests.items():
-        print("Gathering", mission, "file download URLs...", end=' ', flush=True)
-        for request in requests:
-            filenames += web.GetDownloadURLs(*request)
-        print("Gathered.")
+    if confirm is not None and not confirm(s):
+        return None
 
     # put filenames in DB
     print("Inserting download URLs into database...", end=' ', flush=True)
-    s = 0
-    for filename in filenames:
+    entries = []
+    for granule in granules:
         # fix name
+        filename = granule["url"]
         name = GenFilename(filename.split('/')[-1])
 
         # if the file isn't in the timespan, don't queue it up
-        date = util.GetFileProperties(name)["date"]
+        date = util.GetFileProperties(name).date
         if date > timespan.end or date < timespan.start:
             continue
 
-        # if the file is in the database, don't queue it up and alert user.
-        if sql.Exists("L2_files", name):
-            print("The file", name, "is already present, either as a queued file, or on the disk. It won't be downloaded.")
-            continue
-
         db_entry = {
             "id": name,
             "download_url": filename,
             "target": util.ProduceL3mFilename(name),
-            "priority": priority
+            "priority": priority,
+            "checksum": granule.get("checksum"),
+            "checksum_algorithm": granule.get("checksum_algorithm"),
+            "size": granule.get("size")
             }
-        sql.QueueFile(db_entry)
-        s+=1
+        entries.append(db_entry)
+
+    # queue all new files in a single transaction, skipping the ones already in the database
+    queued = sql.QueueFiles(entries)
 
     print("Done.")
-    print(s, "files queued.")
+    print(queued, "files queued.")
+    if queued < len(entries):
+        print(len(entries) - queued, "files are already present, either as queued files, or on the disk. They won't be downloaded.")
+
+    return queued
+
+def main():
+
+    missions, timespan, priority = GetUserInput()
+
+    if QueueRequest(missions, timespan, priority, ConfirmQueuing) is None:
+        exit("Program terminated")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
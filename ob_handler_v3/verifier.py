@@ -9,6 +9,7 @@ The script will check for inconsistensies in the file management database, and i
 
 How-to-Use:
 Run this script while no other scripts relating to the files are running (queuer.py, downloader.py, processor.py)
+The data folder is listed once, the database is loaded once, and all the fixes are applied in a single transaction.
 The inconsistensies come in three types:
 1. A missing file being labeled as existing.
 2. An existing file being labeled as missing.
@@ -20,101 +21,111 @@ A prompt will be displayed to the user, inquiring whether to delete the unnecess
 import params
 import _util as util
 import _sqlhandler as sql
-
-def HandleL2():
-    
-    hasTarget = false
-    hasTarget = 
+import _webhandler as web
+
+import os
+
+# returns a {filename: location} dictionary of all the files under the given folder, skipping partial downloads
+def ScanTree(path):
+    files = dict()
+    folders = [path]
+    while folders:
+        folder = folders.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            continue
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(entry.path + '/')
+            elif not entry.name.endswith(web.PART_SUFFIX):
+                try:
+                    util.GetFileProperties(entry.name)
+                except (ValueError, IndexError):
+                    print("Ignoring", entry.path, "- not a data file.")
+                    continue
+                files[entry.name] = folder
+
+    return files
+
+# compares the L3m files on the disk with the database
+# returns the fixes (new, found, lost) and the set of L3m files on the disk
+def VerifyL3m():
     print("Getting list of all L3m files on the disk...", end=' ', flush=True)
-    l2List = util.GetExistingFilenamesAndPaths(params.path_to_data+"L2/") # gets a list that [0] is the location and [1] is the filename
-    print("Done.")
+    on_disk = ScanTree(params.path_to_data + "L3m/")
+    print("Done,", len(on_disk), "files.")
 
-    print("Verifying those files' entries in the database...", flush=True)
-    location_pointer = 0
-    for filename in l2List[1]:
+    records = sql.GetFileRecords("L3m_files")
 
-        # get file status
-        status = sql.GetFileStatus("L2_files", filename)
-       
-        # if the file isn't in the DB at all, notify user and insert it
-        if status is None:
-            print("The file", filename, "was not found in the database. Inserting it.")
-            entry = {"id": filename, "location": l2List[0][location_pointer], "file_status": 1}
-            sql.InsertL3m(entry)
+    new = [(f, location) for f, location in on_disk.items() if f not in records]
+    found = [(f, location) for f, location in on_disk.items()
+             if f in records and (records[f][0] == 0 or records[f][1] != location)]
+    lost = [f for f, (status, location) in records.items() if status > 0 and f not in on_disk]
 
-        # else, check if the database displays correct status
-        elif status == 0:
-            print("The file", filename, "was listed as missing despite its presence on the disk. Marking it as existing.")
-            sql.UpdateStatus("L3m_files", filename, 1)
+    print(len(new), "L3m files were not found in the database, and will be inserted.")
+    print(len(found), "L3m files were listed as missing despite their presence on the disk, or in another location, and will be marked as existing.")
+    print(len(lost), "L3m files are listed as existing, but are not present on the disk, and will be marked as missing.")
 
-        # as this file was dealt with, set its verifier bit to 1
-        sql.VerifyFile("L2_files", filename)
-        location_pointer += 1
-    print("Existing file verification done.")
+    return new, found, lost, set(on_disk)
 
-    # if there are any database entries remaining that are listed as existing,
-    # but aren't on the disk, notify user and update DB
-    print("Verifying that no missing files were marked as existing...")
-    unverified_existing = sql.GetUnverifiedExisting("L3m_files") # need to add the function
-    for id in unverified_existing:
-        print("The file", id, "is listed as existing on the DB, but is not present on the disk. Marking it as missing.")
-        sql.UpdateStatus("L2_files", id, 0)
+# compares the L2 files on the disk with the database, given the L3m files on the disk
+# returns the fixes (new, found, lost, processed) and the L2 files that are no longer needed, as full paths
+def VerifyL2(L3m_on_disk):
+    print("Getting list of all L2 files on the disk...", end=' ', flush=True)
+    on_disk = ScanTree(params.path_to_data + "L2/")
+    print("Done,", len(on_disk), "files.")
 
-    # reset the verifier bit to 0
-    sql.ResetVerifier("L2_files")
+    records = sql.GetFileRecords("L2_files")
 
-    print("L2 Verification done.")
+    new = [(f, location) for f, location in on_disk.items() if f not in records]
+    found = [(f, location) for f, location in on_disk.items()
+             if f in records and records[f][0] != 2 and (records[f][0] == 0 or records[f][1] != location)]
 
+    # downloaded files that disappeared before being processed are downloaded again
+    lost = [f for f, (status, location, target) in records.items() if status == 1 and f not in on_disk]
 
-def HandleL3m():
+    # files on the disk whose target has been produced in the meantime
+    processed = [f for f in on_disk if f in records and records[f][0] < 2 and records[f][2] in L3m_on_disk]
+    unnecessary = [on_disk[f] + f for f in on_disk
+                   if (records[f][2] if f in records else util.ProduceL3mFilename(f)) in L3m_on_disk]
 
-    print("Getting list of all L3m files on the disk...", end=' ', flush=True)
-    l3List = util.GetExistingFilenamesAndPaths(params.path_to_data+"L3m/") # gets a list that [0] is the location and [1] is the filename
-    print("Done.")
+    print(len(new), "L2 files were not found in the database, and will be inserted.")
+    print(len(found), "L2 files were listed as missing despite their presence on the disk, or in another location, and will be marked as existing.")
+    print(len(lost), "L2 files are listed as downloaded, but are not present on the disk, and will be queued up for downloading again.")
+    print(len(processed), "L2 files are listed as unprocessed despite their target being present, and will be marked as processed.")
+
+    return new, found, lost, processed, unnecessary
+
+# offers to delete the given L2 files, which have already been processed
+def DeleteUnnecessary(unnecessary):
+    if not unnecessary:
+        return
 
-    print("Verifying those files' entries in the database...", flush=True)
-    location_pointer = 0
-    for filename in l3List[1]:
-
-        # get file status
-        status = sql.GetFileStatus("L3m_files", filename)
-       
-        # if the file isn't in the DB at all, notify user and insert it
-        if status is None:
-            print("The file", filename, "was not found in the database. Inserting it.")
-            file_location = l3List[0][location_pointer] 
-            sql.UpdateL3m(file_location, filename)
-
-        # else, check if the database displays correct status
-        elif status == 0:
-            print("The file", filename, "was listed as missing despite its presence on the disk. Marking it as existing.")
-            sql.UpdateStatus("L3m_files", filename, 1)
-
-        # as this file was dealt with, set its verifier bit to 1
-        sql.VerifyFile("L3m_files", filename)
-        location_pointer += 1
-    print("Existing file verification done.")
-
-    # if there are any database entries remaining that are listed as existing,
-    # but aren't on the disk, notify user and update DB
-    print("Verifying that no missing files were marked as existing...")
-    unverified_existing = sql.GetUnverifiedExisting("L3m_files") # need to add the function
-    for id in unverified_existing:
-        print("The file", id, "is listed as existing on the DB, but is not present on the disk. Marking it as missing.")
-        sql.UpdateStatus("L3m_files", id, 0)
-
-    # reset the verifier bit to 0
-    sql.ResetVerifier("L3m_files")
-
-    print("L3m Verification done.")
+    answer = input(f"{len(unnecessary)} L2 files have already been processed. Delete them? (y/n) ")
+    if answer.strip().lower() != 'y':
+        return
+
+    freed = 0
+    for fullpath in unnecessary:
+        freed += os.path.getsize(fullpath)
+        os.remove(fullpath)
+    sql.AddDiskUsage(-freed)
+    print("Deleted", len(unnecessary), "files, freeing", round(freed / 2**30, 2), "GB.")
 
 def main():
 
-    # handle L3m files
-    HandleL3m()
-    
-    # handle L2 files
-    HandleL2()
+    # handle L3m files first, as L2 files are only processed if their target exists
+    new_L3m, found_L3m, lost_L3m, L3m_on_disk = VerifyL3m()
+    new_L2, found_L2, lost_L2, processed_L2, unnecessary = VerifyL2(L3m_on_disk)
+
+    print("Fixing the database...", end=' ', flush=True)
+    sql.ApplyVerification(new_L3m, found_L3m, lost_L3m, new_L2, found_L2, lost_L2, processed_L2)
+    print("Done.")
+
+    DeleteUnnecessary(unnecessary)
+
+    print("Verification done.")
 
 if __name__ == "__main__":
     main()
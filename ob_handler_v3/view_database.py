@@ -5,6 +5,9 @@ import _util as util
 import _sqlhandler as sql
 
 def UserInput():
+    # what sattelites - all of them if none are given
+    missions = [util.ID_TO_NAME[id.upper()] for id in input(util.mission_prompt)]
+
     try:
         start_date = datetime.strptime(
             input("Please put the start date from which you want the data, in the following format: YYYY-MM-DD.\nYour answer: "),
@@ -16,19 +19,16 @@ def UserInput():
         print("An invalid date was entered.")
         exit("Program terminated.")
 
-    return start_date, end_date, 
+    return missions, start_date, end_date
 
 
 def main():
     
-    start_date, end_date = UserInput()  
-    files = sql.GetExisting("L3m_files") 
+    missions, start_date, end_date = UserInput()  
     
-    for f in files:
-        properties = util.GetFileProperties(f)
-        if properties["date"] >= start_date and properties["date"] <= end_date:
-            # the logic is in here
-            print("The file name: ", f, "The file status: ", sql.GetFileStatus("L3m_files", f))
+    # the existing files in the timespan
+    for f, status, location in sql.SelectInRange("L3m_files", start_date, end_date, missions, existing=True):
+        print("The file name: ", f, "The file status: ", status)
 
     
     